@@ -1,5 +1,6 @@
 # Python built-in modules
 from bisect import bisect_left  # search sorted keyframe lists
+import weakref  # animated nodes evaluated together while alive
 
 # External, non built-in modules
 import OpenGL.GL as GL  # standard Python OpenGL wrapper
@@ -11,6 +12,8 @@ from transform import (
     lerp,
     quaternion_slerp,
     quaternion_matrix,
+    quaternion_slerps,
+    trs_matrices,
     translate,
     rotate,
     scale,
@@ -63,38 +66,224 @@ class TransformKeyFrames:
         return TM @ RM @ SM
 
 
+class KeyFrameTracks:
+    """Keyframes of many tracks compiled into contiguous float32 arrays, all
+    tracks being evaluated together in a few vectorized calls"""
+
+    def __init__(self, tracks, interpolation="lerp"):
+        """tracks are KeyFrames or keyframe dicts, whose values have the same
+        size or are scalars, interpolation is "lerp" or "slerp" for
+        quaternions"""
+        tracks = [
+            track if isinstance(track, KeyFrames) else KeyFrames(track)
+            for track in tracks
+        ]
+        counts = np.array([len(track.times) for track in tracks])
+        self.first = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self.last = self.first + counts - 1
+        self.times = np.concatenate([track.times for track in tracks]).astype(
+            np.float32
+        )
+        values = [
+            np.asarray(value, np.float32).ravel()
+            for track in tracks
+            for value in track.values
+        ]
+        size = max(len(value) for value in values)
+        self.values = np.array([np.broadcast_to(value, size) for value in values])
+        self.interpolation = interpolation
+
+        # keys of track i are shifted past those of track i - 1, so that a
+        # single searchsorted call finds the keyframes of all tracks
+        width = float(self.times.max() - self.times.min()) + 1
+        self.offsets = np.arange(len(tracks)) * width - self.times.min()
+        self.keys = self.times + np.repeat(self.offsets, counts)
+
+    def value(self, times):
+        """(N, size) values of the N tracks, at a time per track or at the
+        same time for all, clamped to the times of each track"""
+        times = np.clip(times, self.times[self.first], self.times[self.last])
+        index = np.searchsorted(self.keys, times + self.offsets, "right") - 1
+        index = np.clip(index, self.first, np.maximum(self.last - 1, self.first))
+        following = np.minimum(index + 1, self.last)
+        span = self.times[following] - self.times[index]
+        fraction = (times - self.times[index]) / np.where(span > 0, span, 1)
+        start, end = self.values[index], self.values[following]
+        if self.interpolation == "slerp":
+            return quaternion_slerps(start, end, fraction)
+        return start + fraction[:, np.newaxis].astype(np.float32) * (end - start)
+
+
+class TransformTracks:
+    """TransformKeyFrames of many nodes compiled as KeyFrameTracks, their TRS
+    matrices evaluated together"""
+
+    def __init__(self, keyframes):
+        self.T = KeyFrameTracks([frames.T for frames in keyframes])
+        self.R = KeyFrameTracks([frames.R for frames in keyframes], "slerp")
+        self.S = KeyFrameTracks([frames.S for frames in keyframes])
+
+    def value(self, times):
+        """(N, 4, 4) transforms, at a time per node or at the same time"""
+        return trs_matrices(
+            self.T.value(times), self.R.value(times), self.S.value(times)
+        )
+
+
+class AnimationBatch:
+    """Transforms of keyframe control nodes, evaluated for all of them in one
+    TransformTracks call per time value, instead of once per node"""
+
+    def __init__(self):
+        self.nodes = weakref.WeakSet()
+        self.rows = None  # node -> row in tracks, None to compile again
+        self.tracks, self.loops = None, None
+        self.time, self.transforms = None, None
+
+    def add(self, node):
+        """register node, animated by its keyframes and optional loop time"""
+        self.nodes.add(node)
+        self.rows = None
+
+    def discard(self, node):
+        """unregister node, e.g. when its playback is baked"""
+        self.nodes.discard(node)
+        self.rows = None
+
+    def invalidate(self):
+        """compile tracks again, to call when keyframes of a node change"""
+        self.rows = None
+
+    def transform(self, node, time):
+        """transform of node at time, looped by its loop time if any"""
+        if self.rows is None or len(self.rows) != len(self.nodes):
+            nodes = list(self.nodes)
+            self.rows = weakref.WeakKeyDictionary(
+                (node, row) for row, node in enumerate(nodes)
+            )
+            self.tracks = TransformTracks([node.keyframes for node in nodes])
+            self.loops = np.array([getattr(node, "loop", np.inf) for node in nodes])
+            self.time = None
+        if time != self.time:
+            self.transforms = self.tracks.value(np.mod(time, self.loops))
+            self.time = time
+        return self.transforms[self.rows[node]]
+
+
+animations = AnimationBatch()  # all keyframe control nodes
+
+
+class BakedLoop:
+    """Looping TransformKeyFrames sampled into a table of transforms at a
+    fixed rate, played back by index instead of interpolating keyframes"""
+
+    def __init__(self, keyframes, loop, rate=240):
+        self.loop = loop
+        self.samples = max(int(round(loop * rate)), 1)  # table has one more
+        times = np.linspace(0, loop, self.samples + 1)
+        self.table = TransformTracks([keyframes]).value(times)
+        self.nbytes = self.table.nbytes
+
+    def value(self, time, blend=True):
+        """transform at time modulo loop, linearly blended between samples"""
+        position = time % self.loop / self.loop * self.samples
+        index = min(int(position), self.samples - 1)
+        if not blend:
+            return self.table[int(round(position))]
+        fraction = position - index
+        return (1 - fraction) * self.table[index] + fraction * self.table[index + 1]
+
+
+_baked_loops = weakref.WeakValueDictionary()  # shared tables, by content
+
+
+def bake(keyframes, loop, rate=240):
+    """BakedLoop of keyframes, shared with every other user of the same
+    keyframes, loop and rate while one is alive"""
+    key = (loop, rate) + tuple(
+        (tuple(frames.times), repr([np.asarray(v).tolist() for v in frames.values]))
+        for frames in (keyframes.T, keyframes.R, keyframes.S)
+    )
+    baked = _baked_loops.get(key)
+    if baked is None:
+        baked = _baked_loops[key] = BakedLoop(keyframes, loop, rate)
+    return baked
+
+
+def baked_nbytes():
+    """memory of all live baked tables"""
+    return sum(baked.nbytes for baked in _baked_loops.values())
+
+
 class KeyFrameControlNode(Node):
     """Place node with transform keys above a controlled subtree"""
 
+    animated = True
+
     def __init__(self, translate_keys, rotate_keys, scale_keys, transform=identity()):
         super().__init__(transform=transform)
         self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
 
+    @property
+    def keyframes(self):
+        return self._keyframes
+
+    @keyframes.setter
+    def keyframes(self, keyframes):
+        """new keyframes, compiled again with other nodes"""
+        self._keyframes = keyframes
+        animations.add(self)
+
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
         """When redraw requested, interpolate our node transform from keys"""
-        self.transform = self.keyframes.value(glfw.get_time())
+        self.transform = animations.transform(self, glfw.get_time())
         super().draw(primitives=primitives, **uniforms)
 
 
 class KeyFrameLoopControlNode(Node):
     """
     Place node with transform keys above a controlled subtree.
-    Also loops the animation
+    Also loops the animation, optionally played back from a table baked at
+    bake samples per second, with blend between samples, see BakedLoop
     """
 
-    def __init__(self, translate_keys, rotate_keys, scale_keys, transform=identity()):
+    animated = True
+
+    def __init__(
+        self,
+        translate_keys,
+        rotate_keys,
+        scale_keys,
+        transform=identity(),
+        bake=None,
+        blend=True,
+    ):
         super().__init__(transform=transform)
+        self.bake_rate, self.blend = bake, blend
         self.keyframes = TransformKeyFrames(translate_keys, rotate_keys, scale_keys)
+
+    @property
+    def keyframes(self):
+        return self._keyframes
+
+    @keyframes.setter
+    def keyframes(self, keyframes):
+        """new keyframes, baked again or compiled again with other nodes"""
+        self._keyframes = keyframes
         self.loop = max(
-            [
-                max(self.keyframes.T.times),
-                max(self.keyframes.R.times),
-                max(self.keyframes.S.times),
-            ]
+            [max(keyframes.T.times), max(keyframes.R.times), max(keyframes.S.times)]
         )
+        if self.bake_rate:
+            self.baked = bake(keyframes, self.loop, self.bake_rate)
+            animations.discard(self)
+        else:
+            self.baked = None
+            animations.add(self)  # also compiles tracks again if already in
 
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
         """When redraw requested, interpolate our node transform from keys"""
-        time = glfw.get_time() % self.loop
-        self.transform = self.keyframes.value(time)
+        if self.baked is not None:
+            self.transform = self.baked.value(glfw.get_time(), self.blend)
+        else:
+            self.transform = animations.transform(self, glfw.get_time())
         super().draw(primitives=primitives, **uniforms)
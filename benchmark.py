@@ -0,0 +1,563 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the scene building blocks, run one with:
+    ./benchmark.py <name> [options]
+"""
+
+import argparse
+import json
+import resource
+import sys
+import time
+
+import numpy as np  # all matrix manipulations & OpenGL args
+
+from terrain import grid_positions, grid_index
+import transform
+from transform import vec, normalized, quaternion_mul, quaternion_from_axis_angle
+
+
+def timed(function, *args, repeat=3):
+    """best wall time of repeat calls to function, and its last result"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_grid(args):
+    """desert grid construction time and bytes uploaded per index mode"""
+    print("%6s %-9s %10s %12s %12s" % ("N", "mode", "build ms", "vertex B", "index B"))
+    for N in args.sizes:
+        for mode in ("triangles", "strip", "strip16"):
+            build = lambda: (grid_positions(N, 1800.0), grid_index(N, mode))
+            seconds, (position, (index, _)) = timed(build)
+            print(
+                "%6d %-9s %10.2f %12d %12d"
+                % (N, mode, seconds * 1000, position.nbytes, index.nbytes)
+            )
+
+
+# -------------- camera path benchmarks of the whole scene -------------------
+def orbit(azimuth, elevation):
+    """trackball rotation looking at the target from given angles in degrees,
+    the azimuth turning around the vertical axis"""
+    return quaternion_mul(
+        quaternion_from_axis_angle((1, 0, 0), elevation),
+        quaternion_from_axis_angle((0, 1, 0), azimuth),
+    )
+
+
+class CameraPath:
+    """Trackball motion interpolated from keys (time, pan, distance, rotation),
+    pan being the trackball pos2d and rotation its quaternion"""
+
+    def __init__(self, keys):
+        from animation import TransformKeyFrames  # needs an OpenGL install
+
+        # translation keyframes carry pan and distance, as (x, y, distance)
+        self.keyframes = TransformKeyFrames(
+            {time: vec(*pan, distance) for time, pan, distance, _ in keys},
+            {time: rotation for time, _, _, rotation in keys},
+            {0: 1},
+        )
+        self.duration = max(key[0] for key in keys)
+
+    def apply(self, trackball, time):
+        """move trackball to its position on the path at given time"""
+        *pan, distance = self.keyframes.T.value(time)
+        trackball.pos2d, trackball.distance = vec(*pan), distance
+        trackball.rotation = self.keyframes.R.value(time)
+
+    @staticmethod
+    def load(file):
+        """path recorded as a JSON list of {time, pan, distance, rotation}"""
+        with open(file) as stream:
+            keys = json.load(stream)
+        return CameraPath(
+            [
+                (key["time"], key["pan"], key["distance"], vec(*key["rotation"]))
+                for key in keys
+            ]
+        )
+
+
+CAMERA_PATHS = dict(
+    # whole scene seen from above, one turn around the castle
+    flyover=[(t * 1.5, (0, 0), 1200, orbit(t * 45, 40)) for t in range(9)],
+    # zoom from the default view down to the castle, then half a turn around
+    castle=[(0, (0, 0), 1000, orbit(0, 50)), (4, (0, 0), 150, orbit(0, 15))]
+    + [(4 + t * 1.5, (0, 0), 150, orbit(t * 45, 15)) for t in range(1, 5)],
+    # grazing view across the dunes, worst case for the desert level of detail
+    horizon=[(t * 2, (0, 0), 900, orbit(t * 45, 3)) for t in range(5)],
+)
+
+
+def percentiles(values):
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return dict(p50=float(p50), p95=float(p95), p99=float(p99))
+
+
+def run_path(viewer, path, fps):
+    """render path with the viewer at a simulated fps, returns its metrics"""
+    from core import memory_stats  # imported with the GL context
+
+    frames = viewer.benchmark(
+        int(path.duration * fps) + 1,
+        1 / fps,
+        on_frame=lambda time: path.apply(viewer.trackball, time),
+    )
+    return dict(
+        frames=len(frames),
+        cpu_ms=percentiles([frame["cpu_ms"] for frame in frames]),
+        gpu_ms=percentiles([frame["gpu_ms"] for frame in frames]),
+        draw_calls=float(np.mean([frame["draw_calls"] for frame in frames])),
+        triangles=float(np.mean([frame["triangles"] for frame in frames])),
+        matrices=float(
+            np.mean([frame.get("matrices_recomputed", 0) for frame in frames])
+        ),
+        buffer_mb=memory_stats["buffer_bytes"] / 2**20,
+        buffer_saved_mb=memory_stats["buffer_bytes_saved"] / 2**20,
+        peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10,
+    )
+
+
+def compare(results, baseline, tolerance):
+    """print results against baseline, returns names of regressed metrics"""
+    regressions = []
+    print("%-8s %-14s %12s %12s %8s" % ("path", "metric", "baseline", "run", "delta"))
+    for name, metrics in results.items():
+        for metric in ("cpu_ms", "gpu_ms", "draw_calls", "triangles", "matrices"):
+            for stat in ("p50", "p95", "p99") if metric.endswith("_ms") else (None,):
+                run = metrics[metric] if stat is None else metrics[metric][stat]
+                old = baseline.get(name, {}).get(metric)
+                old = old if stat is None or old is None else old[stat]
+                label = metric if stat is None else "%s %s" % (metric, stat)
+                if old is None:
+                    print("%-8s %-14s %12s %12.2f" % (name, label, "-", run))
+                    continue
+                delta = (run - old) / old if old else 0.0
+                flag = " <- regression" if delta > tolerance else ""
+                print(
+                    "%-8s %-14s %12.2f %12.2f %+7.1f%%%s"
+                    % (name, label, old, run, 100 * delta, flag)
+                )
+                if flag:
+                    regressions.append("%s %s" % (name, label))
+    return regressions
+
+
+def bench_camera(args):
+    """frame times, draw calls, triangles and memory of the scene of viewer.py
+    along camera paths, compared to an optional baseline run"""
+    from core import Viewer  # GL context and scene only needed by this one
+    from viewer import build_scene
+
+    paths = {name: CameraPath(keys) for name, keys in CAMERA_PATHS.items()}
+    paths.update({file: CameraPath.load(file) for file in args.path_files})
+    paths = {name: paths[name] for name in args.paths or paths}
+
+    viewer = Viewer(*args.size, headless=True)
+    build_scene(viewer)
+    results = {name: run_path(viewer, path, args.fps) for name, path in paths.items()}
+
+    if args.save:
+        with open(args.save, "w") as stream:
+            json.dump(results, stream, indent=2)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as stream:
+            baseline = json.load(stream)
+    regressions = compare(results, baseline, args.tolerance)
+    summary = ", ".join(
+        "%s %.0f MB buffers (%.1f MB saved) %.0f MB peak RSS"
+        % (
+            name,
+            metrics["buffer_mb"],
+            metrics["buffer_saved_mb"],
+            metrics["peak_rss_mb"],
+        )
+        for name, metrics in results.items()
+    )
+    print("memory:", summary)
+    if regressions:
+        sys.exit("%d regressions: %s" % (len(regressions), ", ".join(regressions)))
+
+
+# -------------- streamed vertex updates -------------------------------------
+def bench_stream(args):
+    """per frame cost of changing the positions of a vertex array: recreating
+    it, updating it whole with buffer orphaning or a ring buffer, or updating
+    a hundredth of its vertices"""
+    import OpenGL.GL as GL  # GL context only needed by this one
+    from core import Viewer, Shader, VertexArray, frame_stats
+
+    viewer = Viewer(*args.size, headless=True)  # GL context and framebuffer
+    viewer.framebuffer.bind()
+    shader = Shader("vertex_shader_objects.vs", "fragment_shader.fs")
+    GL.glUseProgram(shader.glid)
+
+    def recreate(vertex_array, attributes, position):
+        vertex_array = VertexArray(shader, dict(attributes, position=position))
+        frame_stats["buffer_bytes_uploaded"] += vertex_array.nbytes
+        return vertex_array
+
+    def update(vertex_array, attributes, position):
+        vertex_array.update("position", position)
+        return vertex_array
+
+    def partial(vertex_array, attributes, position):
+        count = max(len(position) // 100, 1)
+        vertex_array.update("position", position[:count])
+        return vertex_array
+
+    # method and ring size of the vertex array
+    methods = dict(
+        recreate=(recreate, 1),
+        orphan=(update, 1),
+        ring=(update, 3),
+        partial=(partial, 1),
+    )
+    print("%9s %-9s %10s %12s" % ("vertices", "method", "frame ms", "uploaded B"))
+    for N in args.vertices:
+        rng = np.random.default_rng(0)
+        attributes = dict(
+            position=rng.random((N, 3), np.float32),
+            normal=np.tile(np.float32((0, 1, 0)), (N, 1)),
+        )
+        moves = [attributes["position"] + np.float32(i / 10) for i in range(2)]
+        for name, (method, ring) in methods.items():
+            vertex_array = VertexArray(shader, attributes, ring=ring)
+
+            def frames():
+                array = vertex_array
+                for frame in range(args.frames):
+                    array = method(array, attributes, moves[frame % 2])
+                    array.execute(GL.GL_POINTS)
+                    GL.glFlush()
+                GL.glFinish()
+
+            frame_stats.clear()
+            repeat = 3
+            seconds, _ = timed(frames, repeat=repeat)
+            print(
+                "%9d %-9s %10.3f %12d"
+                % (
+                    N,
+                    name,
+                    seconds / args.frames * 1000,
+                    frame_stats["buffer_bytes_uploaded"] / repeat / args.frames,
+                )
+            )
+
+
+# -------------- skinning weights of loaded meshes ---------------------------
+def dense_skinning_weights(vertex_ids, bone_ids, weights, nb_vertices):
+    """former loader code: MAX_BONES sorted (weight, id) pairs per vertex"""
+    from core import MAX_BONES
+
+    vbone = np.array(
+        [[(0, 0)] * MAX_BONES] * nb_vertices, dtype=[("weight", "f4"), ("id", "u4")]
+    )
+    for vertex_id, bone_id, weight in zip(vertex_ids, bone_ids, weights):
+        vbone[vertex_id][bone_id] = (weight, bone_id)
+    vbone.sort(order="weight")
+    vbone = vbone[:, -4:]
+    return vbone["id"], vbone["weight"]
+
+
+def bench_skinning(args):
+    """per vertex top 4 bone weights of a synthetic rig, with the former dense
+    array of MAX_BONES weights per vertex and the flat vectorized version"""
+    from core import skinning_weights  # needs an OpenGL install
+
+    rng = np.random.default_rng(0)
+    V, B = args.rig
+    influences = rng.integers(1, 9, V)  # bones per vertex
+    vertex_ids = np.repeat(np.arange(V), influences)
+    bone_ids = np.concatenate([rng.choice(B, n, replace=False) for n in influences])
+    weights = rng.random(len(vertex_ids), np.float32)
+    triples = (vertex_ids, bone_ids.astype(np.uint32), weights, V)
+
+    print("%d vertices, %d bones, %d weights" % (V, B, len(weights)))
+    flat_seconds, flat = timed(skinning_weights, *triples)
+    dense_seconds, dense = timed(dense_skinning_weights, *triples, repeat=1)
+    same = all(np.array_equal(a, b) for a, b in zip(flat, dense))
+    print("%-8s %10.1f ms" % ("dense", dense_seconds * 1000))
+    print("%-8s %10.1f ms, same result: %s" % ("flat", flat_seconds * 1000, same))
+
+
+# -------------- transform.py scalar and batched paths -----------------------
+def former_quaternion_mul(q1, q2):
+    """former transform.quaternion_mul, on numpy arrays"""
+    return np.dot(
+        np.array(
+            [
+                [q1[0], -q1[1], -q1[2], -q1[3]],
+                [q1[1], q1[0], -q1[3], q1[2]],
+                [q1[2], q1[3], q1[0], -q1[1]],
+                [q1[3], -q1[2], q1[1], q1[0]],
+            ]
+        ),
+        q2,
+    )
+
+
+def former_quaternion_matrix(q):
+    """former transform.quaternion_matrix, on numpy arrays"""
+    q = normalized(q)
+    nxx, nyy, nzz = -q[1] * q[1], -q[2] * q[2], -q[3] * q[3]
+    qwx, qwy, qwz = q[0] * q[1], q[0] * q[2], q[0] * q[3]
+    qxy, qxz, qyz = q[1] * q[2], q[1] * q[3], q[2] * q[3]
+    return np.array(
+        [
+            [2 * (nyy + nzz) + 1, 2 * (qxy - qwz), 2 * (qxz + qwy), 0],
+            [2 * (qxy + qwz), 2 * (nxx + nzz) + 1, 2 * (qyz - qwx), 0],
+            [2 * (qxz - qwy), 2 * (qyz + qwx), 2 * (nxx + nyy) + 1, 0],
+            [0, 0, 0, 1],
+        ],
+        "f",
+    )
+
+
+def former_quaternion_slerp(q0, q1, fraction):
+    """former transform.quaternion_slerp, on numpy arrays"""
+    q0, q1 = normalized(q0), normalized(q1)
+    dot = np.dot(q0, q1)
+    q1, dot = (q1, dot) if dot > 0 else (-q1, -dot)
+    theta = np.arccos(np.clip(dot, -1, 1)) * fraction
+    q2 = normalized(q1 - q0 * dot)
+    return q0 * np.cos(theta) + q2 * np.sin(theta)
+
+
+def bench_transform(args):
+    """N quaternion and matrix operations with the former numpy functions of
+    transform.py, their float scalar paths, and their batched versions"""
+    rng = np.random.default_rng(0)
+    print(
+        "%8s %-20s %12s %12s %12s"
+        % ("N", "function", "former ms", "scalar ms", "batched ms")
+    )
+    for N in args.batch:
+        q0, q1 = rng.normal(size=(2, N, 4)).astype(np.float32)
+        fraction = rng.random(N)
+        axes, vectors = rng.normal(size=(2, N, 3)).astype(np.float32)
+        angles = rng.random(N) * 360
+        out = np.empty((N, 4, 4), np.float32)
+        cases = dict(
+            quaternion_mul=(
+                lambda: [former_quaternion_mul(a, b) for a, b in zip(q0, q1)],
+                lambda: [quaternion_mul(a, b) for a, b in zip(q0, q1)],
+                lambda: transform.quaternion_muls(q0, q1),
+            ),
+            quaternion_matrix=(
+                lambda: [former_quaternion_matrix(q) for q in q0],
+                lambda: [transform.quaternion_matrix(q) for q in q0],
+                lambda: transform.quaternion_matrices(q0, out=out),
+            ),
+            quaternion_slerp=(
+                lambda: [
+                    former_quaternion_slerp(a, b, f)
+                    for a, b, f in zip(q0, q1, fraction)
+                ],
+                lambda: [
+                    transform.quaternion_slerp(a, b, f)
+                    for a, b, f in zip(q0, q1, fraction)
+                ],
+                lambda: transform.quaternion_slerps(q0, q1, fraction),
+            ),
+            rotate=(
+                None,
+                lambda: [transform.rotate(a, b) for a, b in zip(axes, angles)],
+                lambda: transform.rotations(axes, angles, out=out),
+            ),
+            translate=(
+                None,
+                lambda: [transform.translate(v) for v in vectors],
+                lambda: transform.translations(vectors, out=out),
+            ),
+            trs=(
+                None,
+                lambda: [
+                    transform.translate(v)
+                    @ transform.quaternion_matrix(q)
+                    @ transform.scale(2.0)
+                    for v, q in zip(vectors, q0)
+                ],
+                lambda: transform.trs_matrices(vectors, q0, (2.0,), out=out),
+            ),
+        )
+        for name, functions in cases.items():
+            times = [
+                "%12.3f" % (timed(f)[0] * 1000) if f else "%12s" % "-"
+                for f in functions
+            ]
+            print("%8d %-20s %s" % (N, name, " ".join(times)))
+
+
+# -------------- keyframe animation playback ---------------------------------
+class LoopNode:
+    """what AnimationBatch needs of a KeyFrameLoopControlNode, without GL"""
+
+    def __init__(self, keyframes, loop):
+        self.keyframes, self.loop = keyframes, loop
+
+
+def bench_animation(args):
+    """per frame cost of animating N dragons with looping keyframes: one
+    interpolation per node, all nodes batched, or baked table playback"""
+    from animation import AnimationBatch, TransformKeyFrames, bake  # needs OpenGL
+
+    keys = np.linspace(0, 10, 101)[:-1]
+    angles = np.linspace(0, 2 * np.pi, 101)[:-1]
+    keyframes = TransformKeyFrames(
+        {t: vec(np.cos(a) * 100, 0, np.sin(a) * 100) for t, a in zip(keys, angles)},
+        {t: orbit(-np.degrees(a), 0) for t, a in zip(keys, angles)},
+        {0: 1},
+    )
+    loop = keys[-1]
+    print("%6s %-12s %10s %10s" % ("N", "playback", "frame ms", "table KB"))
+    for N in args.batch:
+        nodes = [LoopNode(keyframes, loop) for _ in range(N)]
+        batch = AnimationBatch()
+        for node in nodes:
+            batch.add(node)
+        baked = [bake(keyframes, loop, args.bake_rate) for _ in nodes]
+        playbacks = dict(
+            interpolate=lambda time: [
+                node.keyframes.value(time % node.loop) for node in nodes
+            ],
+            batched=lambda time: [batch.transform(node, time) for node in nodes],
+            baked=lambda time: [table.value(time) for table in baked],
+        )
+        for name, playback in playbacks.items():
+            frames = np.arange(args.frames) / args.fps
+            seconds, _ = timed(lambda: [playback(time) for time in frames])
+            memory = baked[0].nbytes / 1024 if name == "baked" else 0
+            print(
+                "%6d %-12s %10.3f %10.1f"
+                % (N, name, seconds / args.frames * 1000, memory)
+            )
+
+
+# -------------- scene graph traversal ----------------------------------------
+class Marker:
+    """leaf drawable with a box and no GL work, to time traversal alone"""
+
+    bounds = (np.full(3, -1, np.float32), np.ones(3, np.float32))
+
+    def draw(self, **uniforms):
+        pass
+
+
+def bench_scene(args):
+    """per frame cost of drawing random trees of N nodes, one leaf each, while
+    one node moves: recursive Node.draw, or a CompiledScene of the tree"""
+    from core import Node, CompiledScene, ViewFrustum  # needs OpenGL
+
+    rng = np.random.default_rng(0)
+    view = transform.lookat(vec(0, 0, 200), vec(0, 0, 0), vec(0, 1, 0))
+    frustum = ViewFrustum(transform.perspective(45, 16 / 9, 1, 1000) @ view)
+    print("%8s %-12s %10s %10s" % ("N", "traversal", "frame ms", "levels"))
+    for N in args.batch:
+        nodes = [Node()]
+        for i in range(1, N):
+            node = Node([Marker()], transform.translate(rng.uniform(-20, 20, 3)))
+            nodes[rng.integers(i)].add(node)
+            nodes.append(node)
+        compiled = CompiledScene(nodes[0])
+        for name, root in (("recursive", nodes[0]), ("compiled", compiled)):
+
+            def frames():
+                for frame in range(args.frames):
+                    nodes[-1].transform = transform.translate(x=frame % 10)
+                    root.draw(frustum=frustum)
+
+            seconds, _ = timed(frames)
+            levels = len(compiled.levels) if name == "compiled" else 0
+            print(
+                "%8d %-12s %10.3f %10d"
+                % (N, name, seconds / args.frames * 1000, levels)
+            )
+
+
+BENCHMARKS = dict(
+    grid=bench_grid,
+    camera=bench_camera,
+    stream=bench_stream,
+    skinning=bench_skinning,
+    transform=bench_transform,
+    animation=bench_animation,
+    scene=bench_scene,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 250, 500, 750, 1000, 2000, 4000],
+        help="grid sizes N for the grid benchmark",
+    )
+    parser.add_argument(
+        "--vertices",
+        type=int,
+        nargs="+",
+        default=[1000, 10000, 100000, 1000000],
+        help="vertex counts for the stream benchmark",
+    )
+    parser.add_argument(
+        "--frames", type=int, default=100, help="frames per stream measure"
+    )
+    parser.add_argument(
+        "--batch",
+        type=int,
+        nargs="+",
+        default=[1, 10, 100, 1000, 10000],
+        help="operation counts for the transform, animation and scene benchmarks",
+    )
+    parser.add_argument(
+        "--bake-rate",
+        type=float,
+        default=240,
+        help="samples per second of baked animation loops",
+    )
+    parser.add_argument(
+        "--rig",
+        type=int,
+        nargs=2,
+        default=(100000, 100),
+        help="vertices and bones of the skinning benchmark rig",
+    )
+    parser.add_argument(
+        "--paths",
+        nargs="+",
+        help="camera paths to run, among %s and --path-files" % sorted(CAMERA_PATHS),
+    )
+    parser.add_argument(
+        "--path-files",
+        nargs="+",
+        default=[],
+        help="recorded camera paths, JSON lists of {time, pan, distance, rotation}",
+    )
+    parser.add_argument("--fps", type=float, default=60.0, help="simulated clock")
+    parser.add_argument("--size", type=int, nargs=2, default=(1280, 720))
+    parser.add_argument("--save", help="write camera results to this JSON file")
+    parser.add_argument("--baseline", help="camera results to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="relative increase of a baseline metric reported as regression",
+    )
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Python built-in modules
+import os                           # cache directory and file management
+import json                         # non-array part of cached resources
+import hashlib                      # content hashing for cache keys
+import shutil                       # cleanup of partially written entries
+import threading                    # entries may be written by loader threads
+
+# External, non built-in modules
+import numpy as np                  # arrays are stored as memory-mappable .npy
+
+# bump whenever the layout of cached data changes, invalidates older entries
+CACHE_VERSION = 1
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+
+def file_hash(file, *extra):
+    """ Content hash of file, salted with cache version and any extra args """
+    digest = hashlib.sha1(('%d:%r' % (CACHE_VERSION, extra)).encode())
+    with open(file, 'rb') as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# -------------- parsed scene cache -------------------------------------------
+def _scene_dir(key):
+    return os.path.join(CACHE_DIR, 'scenes', key)
+
+
+def load_scene(key):
+    """ Returns the scene description cached under key, or None on a miss.
+        Mesh arrays are memory-mapped, they are only paged in when used. """
+    path = _scene_dir(key)
+    try:
+        with open(os.path.join(path, 'scene.json'), 'r') as stream:
+            scene = json.load(stream)
+    except (OSError, ValueError):
+        return None
+    if scene.get('version') != CACHE_VERSION:
+        return None
+
+    def array(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+    try:
+        for mesh_id, mesh in enumerate(scene['meshes']):
+            prefix = 'mesh%d_' % mesh_id
+            mesh['attributes'] = {name: array(prefix + name)
+                                  for name in mesh['attributes']}
+            mesh['index'] = array(prefix + 'index')
+            if mesh['bones']:
+                mesh['bone_offsets'] = array(prefix + 'bone_offsets')
+        for node, transform in zip(scene['nodes'], array('node_transforms')):
+            node['transform'] = transform
+    except (OSError, ValueError):  # missing or truncated array files
+        return None
+    return scene
+
+
+def save_scene(key, scene):
+    """ Stores a scene description under key, arrays as one .npy per array """
+    path = _scene_dir(key)
+    temp = _temp_dir(path)
+
+    def save(name, data):
+        np.save(os.path.join(temp, name + '.npy'), np.ascontiguousarray(data))
+
+    meshes = []
+    for mesh_id, mesh in enumerate(scene['meshes']):
+        prefix = 'mesh%d_' % mesh_id
+        for name, data in mesh['attributes'].items():
+            save(prefix + name, data)
+        save(prefix + 'index', mesh['index'])
+        if mesh['bones']:
+            save(prefix + 'bone_offsets', mesh['bone_offsets'])
+        meshes.append(dict(attributes=list(mesh['attributes']),
+                           material=mesh['material'], bones=mesh['bones']))
+    save('node_transforms', [node['transform'] for node in scene['nodes']])
+
+    description = dict(
+        version=CACHE_VERSION, meshes=meshes,
+        materials=scene['materials'],
+        nodes=[dict(node, transform=None) for node in scene['nodes']],
+        animation=scene['animation'],
+    )
+    with open(os.path.join(temp, 'scene.json'), 'w') as stream:
+        json.dump(description, stream, default=_to_json)
+
+    _publish(temp, path)
+
+
+def _temp_dir(path):
+    """ Private directory to write an entry before publishing it to path """
+    temp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    os.makedirs(temp, exist_ok=True)
+    return temp
+
+
+def _publish(temp, path):
+    """ Atomically move a written entry to its final path """
+    # a concurrent writer may have been faster than us, keep its entry
+    try:
+        os.replace(temp, path)
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True)
+
+
+# -------------- decoded texture cache -----------------------------------------
+def _texture_dir(key):
+    return os.path.join(CACHE_DIR, 'textures', key)
+
+
+def load_texture(key):
+    """ Mip levels cached under key, as memory-mapped (height, width, 4)
+        RGBA arrays, or None on a miss """
+    path = _texture_dir(key)
+    levels = []
+    try:
+        while True:
+            file = os.path.join(path, 'level%d.npy' % len(levels))
+            if not os.path.exists(file):
+                break
+            levels.append(np.load(file, mmap_mode='r'))
+    except (OSError, ValueError):
+        return None
+    return levels or None
+
+
+def save_texture(key, levels):
+    """ Stores mip levels under key, one raw .npy file per level """
+    path = _texture_dir(key)
+    temp = _temp_dir(path)
+    for level, pixels in enumerate(levels):
+        np.save(os.path.join(temp, 'level%d.npy' % level),
+                np.ascontiguousarray(pixels))
+    _publish(temp, path)
+
+
+def _to_json(value):
+    """ json.dump fallback for numpy arrays and scalars """
+    return np.asarray(value).tolist()
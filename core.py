@@ -1,7 +1,12 @@
 # Python built-in modules
 import os                           # os function, i.e. checking file status
 from itertools import cycle         # allows easy circular choice list
+from collections import Counter     # per-frame rendering statistics
 import atexit                       # launch a function at exit
+import weakref                      # registry of shared resources
+import ctypes                       # byte offsets in interleaved buffers
+import time                         # frame timing, loading budgets
+from concurrent.futures import ThreadPoolExecutor  # background loading
 
 # External, non built-in modules
 import OpenGL.GL as GL              # standard Python OpenGL wrapper
@@ -10,16 +15,35 @@ import numpy as np                  # all matrix manipulations & OpenGL args
 import assimpcy                     # 3D resource loader
 
 # our transform functions
-from transform import Trackball, identity
+from transform import Trackball, identity, translate, scale
+
+# on-disk cache of parsed resources
+from cache import file_hash, load_scene, save_scene
+
+# headless contexts need no display server: PYOPENGL_PLATFORM=egl or osmesa
+# selects the context creation API, on top of the glfw null platform
+HEADLESS_API = {'egl': glfw.EGL_CONTEXT_API,
+                'osmesa': glfw.OSMESA_CONTEXT_API,
+                }.get(os.environ.get('PYOPENGL_PLATFORM'))
+if HEADLESS_API is not None:
+    glfw.init_hint(glfw.PLATFORM, glfw.PLATFORM_NULL)
 
 # initialize and automatically terminate glfw on exit
 glfw.init()
 atexit.register(glfw.terminate)
 
+# rendering counters of the current frame, reset by Viewer at each frame
+frame_stats = Counter()
+
+# bytes of live GPU resources, by kind
+memory_stats = Counter()
+
 
 # ------------ low level OpenGL object wrappers ----------------------------
 class Shader:
     """ Helper class to create and automatically destroy shader program """
+    programs = weakref.WeakSet()  # live shaders, bound to new uniform blocks
+
     @staticmethod
     def _compile_shader(src, shader_type):
         src = open(src, 'r').read() if os.path.exists(src) else src
@@ -53,14 +77,23 @@ class Shader:
                 print(GL.glGetProgramInfoLog(self.glid).decode('ascii'))
                 os._exit(1)
 
+        # connect blocks declared by this program to their shared buffers
+        self.programs.add(self)
+        for name, binding in UniformBlock.bindings.items():
+            self.bind_block(name, binding)
+
         # get location, size & type for uniform variables using GL introspection
         self.uniforms = {}
+        self.values = {}  # name -> last uploaded value, see set_uniforms
         self.debug = debug
         get_name = {int(k): str(k).split()[0] for k in self.GL_SETTERS.keys()}
         for var in range(GL.glGetProgramiv(self.glid, GL.GL_ACTIVE_UNIFORMS)):
             name, size, type_ = GL.glGetActiveUniform(self.glid, var)
             name = name.decode().split('[')[0]   # remove array characterization
-            args = [GL.glGetUniformLocation(self.glid, name), size]
+            location = GL.glGetUniformLocation(self.glid, name)
+            if location == -1:  # member of a uniform block, see UniformBlock
+                continue
+            args = [location, size]
             # add transpose=True as argument for matrix types
             if type_ in {GL.GL_FLOAT_MAT2, GL.GL_FLOAT_MAT3, GL.GL_FLOAT_MAT4}:
                 args.append(True)
@@ -69,11 +102,31 @@ class Shader:
                 print(f'uniform {get_name[type_]} {name}: {call}{tuple(args)}')
             self.uniforms[name] = (self.GL_SETTERS[type_], args)
 
-    def set_uniforms(self, uniforms):
-        """ set only uniform variables that are known to shader """
-        for name in uniforms.keys() & self.uniforms.keys():
-            set_uniform, args = self.uniforms[name]
-            set_uniform(*args, uniforms[name])
+    def set_uniforms(self, uniforms, defaults=None):
+        """ set only uniform variables that are known to shader, taking their
+            value from uniforms, else from the optional defaults dict. Values
+            equal to the last ones uploaded to this program are skipped """
+        for name, (set_uniform, args) in self.uniforms.items():
+            value = uniforms.get(name)
+            if value is None and defaults is not None:
+                value = defaults.get(name)
+            if value is None:
+                continue
+            key = value if isinstance(value, (int, float)) \
+                else np.asarray(value).tobytes()
+            if self.values.get(name) == key:
+                frame_stats['uniform_uploads_skipped'] += 1
+                continue
+            self.values[name] = key
+            set_uniform(*args, value)
+            frame_stats['uniform_uploads'] += 1
+
+    def bind_block(self, name, binding):
+        """ read the uniform block name of this program, if declared, from the
+            buffer bound to binding point """
+        index = GL.glGetUniformBlockIndex(self.glid, name)
+        if index != GL.GL_INVALID_INDEX:
+            GL.glUniformBlockBinding(self.glid, index, binding)
 
     def __del__(self):
         GL.glDeleteProgram(self.glid)  # object dies => destroy GL object
@@ -89,87 +142,789 @@ class Shader:
         GL.GL_INT_VEC3:   GL.glUniform3iv, GL.GL_INT_VEC4:     GL.glUniform4iv,
         GL.GL_SAMPLER_1D: GL.glUniform1iv, GL.GL_SAMPLER_2D:   GL.glUniform1iv,
         GL.GL_SAMPLER_3D: GL.glUniform1iv, GL.GL_SAMPLER_CUBE: GL.glUniform1iv,
+        GL.GL_SAMPLER_2D_ARRAY: GL.glUniform1iv,
         GL.GL_FLOAT_MAT2: GL.glUniformMatrix2fv,
         GL.GL_FLOAT_MAT3: GL.glUniformMatrix3fv,
         GL.GL_FLOAT_MAT4: GL.glUniformMatrix4fv,
     }
 
 
+class Framebuffer:
+    """ Offscreen render target with color and depth renderbuffers """
+    def __init__(self, width, height):
+        self.size = (width, height)
+        self.glid = GL.glGenFramebuffers(1)
+        self.buffers = GL.glGenRenderbuffers(2)
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.glid)
+        for buffer, (storage, attachment) in zip(self.buffers, (
+                (GL.GL_RGBA8, GL.GL_COLOR_ATTACHMENT0),
+                (GL.GL_DEPTH_COMPONENT24, GL.GL_DEPTH_ATTACHMENT))):
+            GL.glBindRenderbuffer(GL.GL_RENDERBUFFER, buffer)
+            GL.glRenderbufferStorage(GL.GL_RENDERBUFFER, storage, *self.size)
+            GL.glFramebufferRenderbuffer(GL.GL_FRAMEBUFFER, attachment,
+                                         GL.GL_RENDERBUFFER, buffer)
+        status = GL.glCheckFramebufferStatus(GL.GL_FRAMEBUFFER)
+        assert status == GL.GL_FRAMEBUFFER_COMPLETE, 'incomplete framebuffer'
+
+    def bind(self):
+        GL.glBindFramebuffer(GL.GL_FRAMEBUFFER, self.glid)
+        GL.glViewport(0, 0, *self.size)
+
+    def read(self):
+        """ color buffer content, as a (height, width, 4) uint8 array """
+        GL.glBindFramebuffer(GL.GL_READ_FRAMEBUFFER, self.glid)
+        pixels = GL.glReadPixels(0, 0, *self.size, GL.GL_RGBA,
+                                 GL.GL_UNSIGNED_BYTE)
+        pixels = np.frombuffer(pixels, np.uint8)
+        return pixels.reshape(self.size[1], self.size[0], 4)[::-1]
+
+    def __del__(self):
+        GL.glDeleteFramebuffers(1, [self.glid])
+        GL.glDeleteRenderbuffers(2, self.buffers)
+
+
+class UniformBlock:
+    """ std140 uniform buffer shared by all programs declaring a uniform block
+        of the same name, e.g. camera and light data: values are written once
+        per update with a single upload, instead of once per program """
+    bindings = {}  # block name -> binding point, allocated on first use
+
+    # std140 base alignment and size in bytes of supported member types
+    LAYOUT = {'float': (4, 4), 'int': (4, 4), 'vec2': (8, 8),
+              'vec3': (16, 12), 'vec4': (16, 16),
+              'mat3': (16, 48), 'mat4': (16, 64)}
+
+    def __init__(self, name, **members):
+        """ members give the GLSL type of each block member, in declaration
+            order, e.g. UniformBlock('Camera', view='mat4', ...) """
+        self.name = name
+        self.members, offset = {}, 0
+        for member, type_ in members.items():
+            alignment, size = self.LAYOUT[type_]
+            offset = -(-offset // alignment) * alignment
+            self.members[member] = (type_, offset, size)
+            offset += size
+        self.data = np.zeros(-(-offset // 16) * 16, np.uint8)
+
+        self.glid = GL.glGenBuffers(1)
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferData(GL.GL_UNIFORM_BUFFER, self.data.nbytes, None,
+                        GL.GL_DYNAMIC_DRAW)
+        self.binding = self.bindings.setdefault(name, len(self.bindings))
+        GL.glBindBufferBase(GL.GL_UNIFORM_BUFFER, self.binding, self.glid)
+        for shader in Shader.programs:
+            shader.bind_block(name, self.binding)
+
+    def update(self, **uniforms):
+        """ write values of known members, then upload the whole block """
+        for name, value in uniforms.items():
+            if name not in self.members:
+                continue
+            type_, offset, size = self.members[name]
+            value = np.asarray(value, np.int32 if type_ == 'int' else 'f')
+            if type_ == 'mat4':
+                value = value.T                  # GLSL is column major
+            elif type_ == 'mat3':
+                value = np.pad(value.T, ((0, 0), (0, 1)))  # vec4 columns
+            else:
+                value = value.ravel()[:size // 4]  # e.g. vec4 given for vec3
+            data = np.ascontiguousarray(value).view(np.uint8).ravel()
+            self.data[offset:offset + data.nbytes] = data
+        GL.glBindBuffer(GL.GL_UNIFORM_BUFFER, self.glid)
+        GL.glBufferSubData(GL.GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        frame_stats['uniform_blocks_uploaded'] += 1
+
+    def __del__(self):
+        GL.glDeleteBuffers(1, [self.glid])
+
+
+# ------------  Compact vertex formats ----------------------------------------
+def quantize_positions(position):
+    """ (N, 3) positions as (N, 4) snorm16 values relative to their bounding
+        box, the 4th column padding rows to 8 bytes, and the dequantization
+        matrix mapping normalized values back to positions """
+    position = np.asarray(position, np.float32)
+    low, high = position.min(axis=0), position.max(axis=0)
+    center, extent = (low + high) / 2, np.maximum((high - low) / 2, 1e-12)
+    packed = np.zeros((len(position), 4), np.int16)
+    packed[:, :3] = np.round((position - center) / extent * 32767)
+    return packed, (translate(center) @ scale(extent)).astype(np.float32)
+
+
+def pack_normals(normal):
+    """ (N, 3) normals as (N, 1) GL_INT_2_10_10_10_REV words of signed
+        normalized x, y, z, normals being made unit length first """
+    normal = np.asarray(normal, np.float32)
+    length = np.linalg.norm(normal, axis=1, keepdims=True)
+    normal = np.round(normal / np.maximum(length, 1e-12) * 511).astype(np.int32)
+    normal &= 0x3FF
+    packed = normal[:, 0] | normal[:, 1] << 10 | normal[:, 2] << 20
+    return packed.astype(np.uint32)[:, np.newaxis]
+
+
+def compact_format(name, data):
+    """ Compact encoding of a (N, size) float32 vertex attribute other than
+        positions, as (data, GL type, size, normalized): 10:10:10:2 normals
+        and unorm16 texture coordinates when in [0, 1], others unchanged """
+    if name == 'normal':
+        return pack_normals(data), GL.GL_INT_2_10_10_10_REV, 4, True
+    if name == 'tex_coord' and data.size and 0 <= data.min() \
+            and data.max() <= 1:
+        data = np.round(data * 65535).astype(np.uint16)
+        return data, GL.GL_UNSIGNED_SHORT, data.shape[1], True
+    return data, GL.GL_FLOAT, data.shape[1], False
+
+
 class VertexArray:
     """ helper class to create and self destroy OpenGL vertex array objects."""
-    def __init__(self, shader, attributes, index=None, usage=GL.GL_STATIC_DRAW):
+    def __init__(self, shader, attributes, index=None, usage=GL.GL_STATIC_DRAW,
+                 instances=None, restart=False, ranges=None, interleaved=False,
+                 compact=False, ring=1):
         """ Vertex array from attributes and optional index array. Vertex
-            Attributes should be list of arrays with one row per vertex. """
+            Attributes should be list of arrays with one row per vertex.
+            Optional instances attributes have one row per instance, matrix
+            attributes are given as (N, 4, 4) arrays; if present, the array
+            is drawn once per instance in a single instanced draw call.
+            Index arrays of dtype uint16 are kept 16 bits, restart enables
+            primitive restart on the largest index value, and optional ranges
+            of (first, count, base_vertex) draw parts of the index buffer
+            with a vertex offset instead of the whole buffer at once.
+            interleaved stores all vertex attributes in a single buffer, the
+            attributes of a vertex next to each other. compact interleaves
+            them with the encodings of compact_format, positions then need
+            the dequantize matrix uniform of the shader, see Mesh.
+            Attributes of their own buffer can be changed with update(),
+            ring > 1 allocates as many copies of them to stream updates. """
 
         # create vertex array object, bind it
         self.glid = GL.glGenVertexArrays(1)
         GL.glBindVertexArray(self.glid)
         self.buffers = []  # we will store buffers in a list
+        self.usage, self.ring = usage, ring
+        self.streams = {}  # attribute name -> updatable buffer, see update()
+        self.nbytes = 0    # total size of the buffers
+        self.saved_bytes = 0  # vertex bytes saved by compact formats
+        self.dequantize = identity()  # maps stored positions to mesh frame
         nb_primitives, size = 0, 0
 
+        # one buffer for all attributes, interleaved per vertex
+        if interleaved or compact:
+            columns, stride, float_bytes = [], 0, 0
+            for name, data in attributes.items():
+                loc = GL.glGetAttribLocation(shader.glid, name)
+                if loc < 0:
+                    continue
+                data = np.asarray(data, np.float32)
+                nb_primitives, float_bytes = len(data), float_bytes + data.nbytes
+                if compact and name == 'position':
+                    data, self.dequantize = quantize_positions(data)
+                    encoded = (data, GL.GL_SHORT, 3, True)
+                elif compact:
+                    encoded = compact_format(name, data)
+                else:
+                    encoded = (data, GL.GL_FLOAT, data.shape[1], False)
+                columns.append((loc, stride) + encoded)
+                stride += -(-encoded[0][0].nbytes // 4) * 4  # 4 bytes aligned
+            vertices = np.zeros((nb_primitives, stride), np.uint8)
+            for _, offset, data, *_ in columns:
+                data = np.ascontiguousarray(data).view(np.uint8)
+                vertices[:, offset:offset + data.shape[1]] = data
+            self.buffers.append(GL.glGenBuffers(1))
+            GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, vertices, usage)
+            self.nbytes += vertices.nbytes
+            self.saved_bytes = float_bytes - vertices.nbytes
+            for loc, offset, _, gl_type, size, normalized in columns:
+                GL.glEnableVertexAttribArray(loc)
+                GL.glVertexAttribPointer(loc, size, gl_type, normalized,
+                                         stride, ctypes.c_void_p(offset))
+
         # load buffer per vertex attribute (in list with index = shader layout)
-        for name, data in attributes.items():
+        for name, data in attributes.items() \
+                if not (interleaved or compact) else ():
             loc = GL.glGetAttribLocation(shader.glid, name)
             if loc >= 0:
                 # bind a new vbo, upload its data to GPU, declare size and type
-                self.buffers.append(GL.glGenBuffers(1))
                 data = np.array(data, np.float32, copy=False)  # ensure format
                 nb_primitives, size = data.shape
                 GL.glEnableVertexAttribArray(loc)
-                GL.glBindBuffer(GL.GL_ARRAY_BUFFER, self.buffers[-1])
-                GL.glBufferData(GL.GL_ARRAY_BUFFER, data, usage)
-                GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, 0, None)
+                self._add_buffer(name, data, [(loc, size, 0, 0)])
+
+        # bounding box of vertex positions, used for view frustum culling
+        self.bounds = aabb(attributes['position']) \
+            if 'position' in attributes else None
 
         # optionally create and upload an index buffer for this object
         self.draw_command = GL.glDrawArrays
         self.arguments = (0, nb_primitives)
+        self.restart, self.ranges = None, None
         if index is not None:
             self.buffers += [GL.glGenBuffers(1)]
-            index_buffer = np.array(index, np.int32, copy=False)  # good format
+            index_buffer = np.asarray(index)
+            if index_buffer.dtype not in (np.uint16, np.uint32):
+                index_buffer = np.array(index, np.int32, copy=False)
             GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, self.buffers[-1])
             GL.glBufferData(GL.GL_ELEMENT_ARRAY_BUFFER, index_buffer, usage)
+            self.nbytes += index_buffer.nbytes
+            index_type = self.INDEX_TYPES[index_buffer.itemsize]
             self.draw_command = GL.glDrawElements
-            self.arguments = (index_buffer.size, GL.GL_UNSIGNED_INT, None)
+            self.arguments = (index_buffer.size, index_type, None)
+            if restart:
+                self.restart = (1 << 8 * index_buffer.itemsize) - 1
+            if ranges is not None:
+                self.ranges = [(count, index_type,
+                                ctypes.c_void_p(first * index_buffer.itemsize),
+                                base_vertex)
+                               for first, count, base_vertex in ranges]
+
+        # optional per instance attributes, advanced once per drawn instance
+        self.instance_count = None
+        for name, data in (instances or {}).items():
+            loc = GL.glGetAttribLocation(shader.glid, name)
+            if loc >= 0:
+                data = self._rows(data)
+                self.instance_count = len(data)
+                if data.ndim == 3:  # GLSL matrices use a location per column
+                    columns, size = data.shape[1:]
+                else:
+                    columns, size = 1, data.shape[1]
+                for column in range(columns):
+                    GL.glEnableVertexAttribArray(loc + column)
+                    GL.glVertexAttribDivisor(loc + column, 1)
+                self._add_buffer(name, data, [
+                    (loc + column, size, columns * size * 4, column * size * 4)
+                    for column in range(columns)])
+        if self.instance_count is not None:
+            self.draw_command = {GL.glDrawArrays: GL.glDrawArraysInstanced,
+                                 GL.glDrawElements: GL.glDrawElementsInstanced
+                                 }[self.draw_command]
+            self.arguments += (self.instance_count,)
+
+        # triangles drawn per execution, by primitive type, for frame_stats
+        if index is None:
+            parts = [(nb_primitives, 0, 1)]  # (indices, restarts, strips)
+        else:
+            parts = []
+            for first, count, _ in ranges or [(0, index_buffer.size, 0)]:
+                part = index_buffer[first:first + count]
+                restarts = np.count_nonzero(part == self.restart) \
+                    if restart else 0
+                ends_strip = part.size > 0 and part[-1] != self.restart
+                parts.append((part.size, restarts, restarts + ends_strip))
+        instances = self.instance_count or 1
+        self.triangles = {
+            GL.GL_TRIANGLES: instances * sum(n // 3 for n, _, _ in parts),
+            GL.GL_TRIANGLE_STRIP: instances * sum(n - restarts - 2 * strips
+                                                  for n, restarts, strips
+                                                  in parts),
+        }
+        memory_stats['buffer_bytes'] += self.nbytes
+        memory_stats['buffer_bytes_saved'] += self.saved_bytes
 
-    def execute(self, primitive):
-        """ draw a vertex array, either as direct array or indexed array """
-        GL.glBindVertexArray(self.glid)
-        self.draw_command(primitive, *self.arguments)
+    @staticmethod
+    def _rows(data):
+        """ float32 attribute rows as laid out in buffers, GLSL matrices
+            being stored column after column """
+        data = np.asarray(data, np.float32)
+        return np.ascontiguousarray(data.transpose(0, 2, 1)) \
+            if data.ndim == 3 else data
+
+    def _add_buffer(self, name, data, pointers):
+        """ Upload data to a new buffer of ring copies, pointers being the
+            (location, size, stride, offset) float attributes it holds """
+        buffer = GL.glGenBuffers(1)
+        self.buffers.append(buffer)
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer)
+        if self.ring > 1:
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, self.ring * data.nbytes, None,
+                            self.usage)
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, data.nbytes, data)
+        else:
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, data, self.usage)
+        self.nbytes += self.ring * data.nbytes
+        # buffer, copy size, row size, pointers, copy in use, copy fences
+        self.streams[name] = [buffer, data.nbytes,
+                              data.nbytes // max(len(data), 1), pointers, 0,
+                              [None] * self.ring]
+        self._point(name)
+
+    def _point(self, name):
+        """ Point attributes of name to the copy in use of their buffer """
+        buffer, nbytes, _, pointers, copy, _ = self.streams[name]
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer)
+        for loc, size, stride, offset in pointers:
+            GL.glVertexAttribPointer(loc, size, GL.GL_FLOAT, False, stride,
+                                     ctypes.c_void_p(copy * nbytes + offset))
+
+    def update(self, name, data, offset=0):
+        """ Replace rows of vertex or instance attribute name from row offset
+            on, uploading only those rows. Replacing all rows writes the next
+            copy of a ring buffer, waiting only for draws that still read it
+            ring frames ago, or orphans the buffer with ring=1, so that draws
+            of previous frames never stall the upload. Partial updates write
+            the copy in use. Interleaved attributes cannot be updated, and
+            bounds are kept: changing positions must keep within them """
+        assert name in self.streams, 'no own buffer for attribute %s' % name
+        stream = self.streams[name]
+        buffer, nbytes, row_bytes, _, copy, fences = stream
+        data = self._rows(data)
+        start = offset * row_bytes
+        assert start + data.nbytes <= nbytes, 'update past end of %s' % name
+        frame_stats['buffer_bytes_uploaded'] += data.nbytes
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer)
+        if data.nbytes < nbytes:
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, copy * nbytes + start,
+                               data.nbytes, data)
+        elif self.ring == 1:
+            GL.glBufferData(GL.GL_ARRAY_BUFFER, nbytes, None, self.usage)
+            GL.glBufferSubData(GL.GL_ARRAY_BUFFER, 0, nbytes, data)
+        else:
+            # fence draws of the copy in use, then wait for the next one's
+            fences[copy] = GL.glFenceSync(GL.GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            copy = stream[4] = (copy + 1) % self.ring
+            if fences[copy] is not None:
+                GL.glClientWaitSync(fences[copy], GL.GL_SYNC_FLUSH_COMMANDS_BIT,
+                                    GL.GL_TIMEOUT_IGNORED)
+                GL.glDeleteSync(fences[copy])
+                fences[copy] = None
+            pointer = GL.glMapBufferRange(
+                GL.GL_ARRAY_BUFFER, copy * nbytes, nbytes,
+                GL.GL_MAP_WRITE_BIT | GL.GL_MAP_INVALIDATE_RANGE_BIT
+                | GL.GL_MAP_UNSYNCHRONIZED_BIT)
+            ctypes.memmove(pointer, data.ctypes.data, nbytes)
+            GL.glUnmapBuffer(GL.GL_ARRAY_BUFFER)
+            GL.glBindVertexArray(self.glid)
+            self._point(name)
+
+    def execute(self, primitive, bind=True):
+        """ draw a vertex array, either as direct array or indexed array.
+            bind=False skips binding, if the array is known to be bound """
+        if bind:
+            GL.glBindVertexArray(self.glid)
+        if self.restart is not None:
+            GL.glEnable(GL.GL_PRIMITIVE_RESTART)
+            GL.glPrimitiveRestartIndex(self.restart)
+        if self.ranges is not None:
+            for arguments in self.ranges:
+                GL.glDrawElementsBaseVertex(primitive, *arguments)
+            frame_stats['draw_calls'] += len(self.ranges)
+        else:
+            self.draw_command(primitive, *self.arguments)
+            frame_stats['draw_calls'] += 1
+        frame_stats['triangles'] += self.triangles.get(primitive, 0)
+        if self.restart is not None:
+            GL.glDisable(GL.GL_PRIMITIVE_RESTART)
 
     def __del__(self):  # object dies => kill GL array and buffers from GPU
+        memory_stats['buffer_bytes'] -= self.nbytes
+        memory_stats['buffer_bytes_saved'] -= self.saved_bytes
+        for *_, fences in self.streams.values():
+            for fence in fences:
+                if fence is not None:
+                    GL.glDeleteSync(fence)
         GL.glDeleteVertexArrays(1, [self.glid])
         GL.glDeleteBuffers(len(self.buffers), self.buffers)
 
+    INDEX_TYPES = {2: GL.GL_UNSIGNED_SHORT, 4: GL.GL_UNSIGNED_INT}
+
 
 # ------------  Mesh is the core drawable -------------------------------------
 class Mesh:
     """ Basic mesh class, attributes and uniforms passed as arguments """
-    def __init__(self, shader, attributes, uniforms=None, index=None):
+    _bounds_model = None  # model matrix of the cached world bounds
+    def __init__(self, shader, attributes, uniforms=None, index=None,
+                 vertex_array=None):
+        """ vertex_array optionally reuses GPU buffers of another mesh, in
+            which case attributes and index are not uploaded again """
         self.shader = shader
-        self.uniforms = uniforms or dict()
-        self.vertex_array = VertexArray(shader, attributes, index)
+        self.vertex_array = vertex_array or VertexArray(shader, attributes,
+                                                        index)
+        self.bounds = self.vertex_array.bounds
+
+        # always set, compact and float positions may share the same program
+        self.uniforms = dict(uniforms or (),
+                             dequantize=self.vertex_array.dequantize)
 
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
+        frustum = uniforms.get('frustum')
+        model = uniforms.get('model')
+        if frustum is not None and self.bounds is not None \
+                and model is not None:
+            if model is not self._bounds_model:  # see Node.update_world
+                self._world_bounds = aabb_transform(model, self.bounds)
+                self._bounds_model = model
+            if not frustum.intersects(self._world_bounds):
+                frame_stats['meshes_culled'] += 1
+                return
+        frame_stats['meshes_drawn'] += 1
+        queue = uniforms.get('queue')
+        if queue is not None:
+            queue.add(self, primitives, uniforms)
+            return
         GL.glUseProgram(self.shader.glid)
-        self.shader.set_uniforms({**self.uniforms, **uniforms})
+        self.shader.set_uniforms(uniforms, self.uniforms)
         self.vertex_array.execute(primitives)
 
 
+class InstancedMesh(Mesh):
+    """ Mesh drawn once per model matrix of an (N, 4, 4) transforms array, all
+        instances in a single draw call. Instance matrices are applied in the
+        mesh frame, before the model matrix of the node holding the mesh """
+    def __init__(self, shader, attributes, transforms, uniforms=None,
+                 index=None, interleaved=False, compact=False):
+        vertex_array = VertexArray(shader, attributes, index,
+                                   instances=dict(instance_model=transforms),
+                                   interleaved=interleaved, compact=compact)
+        super().__init__(shader, attributes, uniforms, index, vertex_array)
+
+        # bounds hold the mesh bounds placed by each of the instances
+        if self.bounds is not None:
+            transforms = np.asarray(transforms, np.float32)
+            center = (self.bounds[0] + self.bounds[1]) / 2
+            extent = (self.bounds[1] - self.bounds[0]) / 2
+            centers = transforms[:, :3, :3] @ center + transforms[:, :3, 3]
+            extents = np.abs(transforms[:, :3, :3]) @ extent
+            self.bounds = ((centers - extents).min(axis=0),
+                           (centers + extents).max(axis=0))
+
+
+# ------------  Static batching ------------------------------------------------
+def merge_meshes(parts, instances=None, compact=False):
+    """ Merge mesh parts into one mesh per render state, each drawn with a
+        single call from one interleaved vertex buffer. parts are tuples
+        (matrix, shader, attributes, index, uniforms, textures), textures
+        being Textured keyword arguments, possibly empty. Part vertices are
+        transformed by their matrix, like the model matrix of the shaders
+        would. With instances, merged meshes are InstancedMesh, compact
+        selects the compact vertex formats of VertexArray. Returns the list
+        of merged drawables, Textured when textures were given. Uniforms
+        unknown to the shader, e.g. unused material colors, are ignored """
+    groups = {}  # render state -> parts
+    for part in parts:
+        _, shader, attributes, _, uniforms, textures = part
+        uniforms = {name: value for name, value in uniforms.items()
+                    if name in shader.uniforms}
+        key = (shader.glid, tuple(sorted(attributes)), _params_key(uniforms),
+               tuple((name, texture.glid)
+                     for name, texture in sorted(textures.items())))
+        groups.setdefault(key, []).append(part)
+
+    drawables = []
+    for group in groups.values():
+        _, shader, _, _, uniforms, textures = group[0]
+        merged, indices, offset = {}, [], 0
+        for matrix, _, attributes, index, _, _ in group:
+            linear, translation = matrix[:3, :3].T, matrix[:3, 3]
+            for name, data in attributes.items():
+                data = np.asarray(data, np.float32)
+                if name == 'position':
+                    data = data @ linear + translation
+                elif name == 'normal':  # not normalized, as in the shaders
+                    data = data @ linear
+                merged.setdefault(name, []).append(data)
+            count = len(attributes['position'])
+            index = np.arange(count) if index is None else np.ravel(index)
+            indices.append(index.astype(np.uint32) + offset)
+            offset += count
+        attributes = {name: np.concatenate(data)
+                      for name, data in merged.items()}
+        index = np.concatenate(indices)
+        if instances is not None:
+            mesh = InstancedMesh(shader, attributes, instances, uniforms,
+                                 index, interleaved=True, compact=compact)
+        else:
+            vertex_array = VertexArray(shader, attributes, index,
+                                       interleaved=True, compact=compact)
+            mesh = Mesh(shader, attributes, uniforms, index, vertex_array)
+        drawables.append(Textured(mesh, **textures) if textures else mesh)
+    return drawables
+
+
+# ------------  Draw queue sorted by render state ------------------------------
+class DrawQueue:
+    """ Collects mesh draws during scene traversal, then submits them sorted
+        by shader, textures and vertex array, changing GL state only when it
+        differs from the previous draw. Meshes enqueue themselves when drawn
+        with a queue=DrawQueue argument, Textured passes its textures along """
+    def __init__(self):
+        self.items = []
+
+    def add(self, mesh, primitives, uniforms, source=None):
+        """ Enqueue mesh, to be drawn with uniforms at next flush. Optional
+            source identifies what drew the mesh, see execute """
+        textures = uniforms.get('textures', ())
+        key = (mesh.shader.glid, tuple(tex.glid for _, tex in textures),
+               mesh.vertex_array.glid)
+        self.items.append((key, mesh, primitives, uniforms, source))
+
+    def flush(self):
+        """ Draw and empty the queue, counting GL state changes in frame_stats
+            as well as the changes avoided compared to unsorted drawing """
+        self.items.sort(key=lambda item: item[0])
+        shader, vertex_array, bound_textures = None, None, {}
+        for _, mesh, primitives, uniforms, source in self.items:
+            changed = mesh.shader is not shader
+            self._count('program', changed)
+            if changed:
+                shader = mesh.shader
+                GL.glUseProgram(shader.glid)
+
+            for unit, texture in uniforms.get('textures', ()):
+                changed = bound_textures.get(unit) is not texture
+                self._count('texture', changed)
+                if changed:
+                    bound_textures[unit] = texture
+                    GL.glActiveTexture(GL.GL_TEXTURE0 + unit)
+                    GL.glBindTexture(texture.type, texture.glid)
+
+            shader.set_uniforms(uniforms, mesh.uniforms)
+            changed = mesh.vertex_array is not vertex_array
+            self._count('vertex_array', changed)
+            vertex_array = mesh.vertex_array
+            self.execute(mesh, primitives, changed, source)
+        self.items.clear()
+
+    def execute(self, mesh, primitives, bind, source):
+        """ Draw call of a queued mesh, its source being that given to add,
+            e.g. to attribute the draw to a node when profiling """
+        mesh.vertex_array.execute(primitives, bind=bind)
+
+    @staticmethod
+    def _count(state, changed):
+        frame_stats[state + ('_binds' if changed else '_binds_avoided')] += 1
+
+
+# ------------  Registry of resources shared between scene objects -----------
+class ResourceRegistry:
+    """ Hands back the same resource to every user of the same key. Entries
+        are reference counted through weak references: a resource lives as
+        long as one user holds it, then its GL objects are freed as usual """
+    def __init__(self):
+        self.entries = weakref.WeakValueDictionary()
+        self.hits, self.misses = 0, 0
+
+    def get(self, key, factory):
+        """ Shared resource for key, created with factory() if none is alive """
+        resource = self.entries.get(key)
+        if resource is None:
+            self.misses += 1
+            resource = factory()
+            if resource is not None:  # failures are not remembered
+                self.entries[key] = resource
+        else:
+            self.hits += 1
+        return resource
+
+    def __len__(self):
+        return len(self.entries)
+
+
+resources = ResourceRegistry()
+
+
+# ------------  Bounding boxes and view frustum culling -----------------------
+def aabb(points):
+    """ (min, max) corners of the axis aligned box holding (N, 3) points """
+    points = np.asarray(points, np.float32)
+    if points.ndim != 2 or points.shape[1] != 3 or not len(points):
+        return None
+    return points.min(axis=0), points.max(axis=0)
+
+
+def aabb_union(boxes):
+    """ Box holding all boxes, None if one of them is unknown (None) """
+    boxes = list(boxes)
+    if not boxes or any(box is None for box in boxes):
+        return None
+    if len(boxes) == 1:
+        return boxes[0]
+    return (np.min([box[0] for box in boxes], axis=0),
+            np.max([box[1] for box in boxes], axis=0))
+
+
+def aabb_transform(matrix, box):
+    """ Box holding the given box once transformed by a 4x4 matrix """
+    center, extent = (box[0] + box[1]) / 2, (box[1] - box[0]) / 2
+    center = matrix[:3, :3] @ center + matrix[:3, 3]
+    extent = np.abs(matrix[:3, :3]) @ extent
+    return center - extent, center + extent
+
+
+class ViewFrustum:
+    """ Clip planes of a projection @ view matrix, to cull world boxes """
+    def __init__(self, matrix):
+        m = np.asarray(matrix, np.float64)
+        planes = np.array([m[3] + m[0], m[3] - m[0], m[3] + m[1],
+                           m[3] - m[1], m[3] + m[2], m[3] - m[2]])
+        self.planes = planes / np.linalg.norm(planes[:, :3], axis=1)[:, None]
+        self.abs_normals = np.abs(self.planes[:, :3])
+
+    def intersects(self, box):
+        """ False if the world box is entirely outside one of the planes """
+        center, extent = (box[0] + box[1]) / 2, (box[1] - box[0]) / 2
+        distance = self.planes[:, :3] @ center + self.planes[:, 3]
+        return bool(np.all(distance + self.abs_normals @ extent >= 0))
+
+    def intersects_all(self, centers, extents):
+        """ intersects for (N, 3) world box centers and half extents at once,
+            returns an (N,) boolean array """
+        distance = centers @ self.planes[:, :3].T + self.planes[:, 3]
+        return np.all(distance + extents @ self.abs_normals.T >= 0, axis=1)
+
+
 # ------------  Node is the core drawable for hierarchical scene graphs -------
 class Node:
-    """ Scene graph transform and parameter broadcast node """
-    def __init__(self, children=(), transform=identity()):
+    """ Scene graph transform and parameter broadcast node. World transforms
+        are cached: they are only recomputed when the node transform is
+        assigned or the world transform of the parent changed """
+    animated = False  # True for nodes whose transform changes over time
+    static = False    # True for scenery whose transform is kept, see set_static
+    _model, _world_inverse = None, None  # parent world matrix, inverse cache
+    _worlds = None        # static nodes: id(model) -> (model, world matrix)
+    _max_worlds = 8       # parent matrices remembered by a static node
+    _bounds_world = None  # world_transform of the cached world_bounds
+    _compiled = None      # CompiledScene holding this node, if any
+    _revision = 0         # count of subtree changes, see CompiledScene
+    _parents = None       # nodes holding our bounds in their cached bounds
+
+    def __init__(self, children=(), transform=identity(), name=None):
         self.transform = transform
+        self.name = name  # optional, e.g. to identify nodes when profiling
         self.world_transform = identity()
+        self.world_bounds = None
         self.children = list(iter(children))
+        self._bounds_cached = False
+
+    @property
+    def transform(self):
+        return self._transform
+
+    @transform.setter
+    def transform(self, transform):
+        self._transform = transform
+        self.mark_dirty()  # world transform is recomputed at next draw
+
+    def mark_dirty(self):
+        """ Recompute world transform at next draw, to call after modifying
+            the transform array in place, or moving a static node """
+        self._model = None
+        if self._worlds:
+            self._worlds.clear()
+        if self._compiled is not None:
+            self._compiled.moved.append(self)
+        self._invalidate_parents()
+
+    def set_static(self, static=True):
+        """ Mark this subtree static, for scenery whose transforms are not
+            changed. Its nodes remember their world matrix for each of the
+            last parent matrices they were drawn with, so that a hierarchy
+            shared by several parents, e.g. a loaded model, is not
+            recomputed each time it is drawn below another one """
+        self.static = static
+        self._worlds = {} if static else None
+        self.mark_dirty()
+        for child in self.children:
+            if isinstance(child, Node):
+                child.set_static(static)
+
+    def update_world(self, model):
+        """ Update world_transform below parent world matrix model, if it or
+            our transform changed. Returns True if it was recomputed """
+        if self._model is model:
+            return False
+        self._model, self._world_inverse = model, None
+        if self.static:
+            model_world = self._worlds.get(id(model))
+            if model_world is not None and model_world[0] is model:
+                self.world_transform = model_world[1]
+                return False
+        self.world_transform = model @ self._transform
+        frame_stats['matrices_recomputed'] += 1
+        if self.static:
+            if len(self._worlds) >= self._max_worlds:
+                self._worlds.clear()
+            self._worlds[id(model)] = (model, self.world_transform)
+        return True
+
+    @property
+    def world_inverse(self):
+        """ Inverse of world_transform, cached until it changes """
+        if self._world_inverse is None:
+            self._world_inverse = np.linalg.inv(self.world_transform)
+            frame_stats['matrices_recomputed'] += 1
+        return self._world_inverse
 
     def add(self, *drawables):
-        """ Add drawables to this node, simply updating children list """
+        """ Add drawables to this node, simply updating children list. Nodes
+            added below a static node are made static, see set_static """
         self.children.extend(drawables)
+        if self.static:
+            for drawable in drawables:
+                if isinstance(drawable, Node):
+                    drawable.set_static()
+        self.invalidate_bounds()
+
+    def invalidate_bounds(self):
+        """ Forget cached children bounds, to call if the subtree changed """
+        self._bounds_cached = False
+        self._invalidate_parents()
+        Node._revision += 1
+
+    def _invalidate_parents(self):
+        """ Forget the bounds cached by all ancestors, as they hold ours """
+        for parent in self._parents or ():
+            if not self.animated:  # else never cached, see content_bounds
+                parent._bounds_cached = False
+            parent._invalidate_parents()
+
+    @property
+    def content_bounds(self):
+        """ Box holding the children in this node's frame, None if unknown.
+            Static children boxes are cached, animated ones are recomputed.
+            Moving a node below this one drops the cache, see mark_dirty """
+        if not self._bounds_cached:
+            static, self._animated_children = [], []
+            for child in self.children:
+                animated = getattr(child, 'animated', False)
+                (self._animated_children if animated else static).append(child)
+                if isinstance(child, Node):
+                    if child._parents is None:
+                        child._parents = weakref.WeakSet()
+                    child._parents.add(self)
+            self._static_bounds = [aabb_union(getattr(child, 'bounds', None)
+                                              for child in static)] \
+                if static else []
+            self._bounds_cached = True
+        return aabb_union(self._static_bounds + [
+            child.bounds for child in self._animated_children])
+
+    @property
+    def bounds(self):
+        """ Box holding the subtree in its parent's frame, None if unknown """
+        content = self.content_bounds
+        return None if content is None \
+            else aabb_transform(self.transform, content)
 
     def draw(self, model=identity(), **other_uniforms):
-        """ Recursive draw, passing down updated model matrix. """
-        self.world_transform = model @ self.transform
+        """ Recursive draw, passing down updated model matrix. Subtrees out
+            of the optional frustum (a ViewFrustum) argument are skipped """
+        self.update_world(model)
+        frame_stats['nodes_visited'] += 1
+        frustum = other_uniforms.get('frustum')
+        if frustum is not None:
+            # world bounds are kept while world transform and content are
+            if self._bounds_world is not self.world_transform \
+                    or not self._bounds_cached or self._animated_children:
+                content = self.content_bounds
+                self.world_bounds = None if content is None \
+                    else aabb_transform(self.world_transform, content)
+                self._bounds_world = self.world_transform
+                frame_stats['world_bounds_recomputed'] += 1
+            if self.world_bounds is not None \
+                    and not frustum.intersects(self.world_bounds):
+                frame_stats['nodes_culled'] += 1
+                return
+        frame_stats['nodes_drawn'] += 1
         for child in self.children:
             child.draw(model=self.world_transform, **other_uniforms)
 
@@ -179,14 +934,149 @@ class Node:
             child.key_handler(key)
 
 
+# ------------  Compiled scene graph, flattened into arrays --------------------
+class CompiledScene:
+    """ Array backed copy of node trees, drawn without recursing into them.
+        Plain nodes, whose class keeps Node.draw, become rows of a parent
+        index array and of (N, 4, 4) local and world transform arrays sorted
+        by depth: world transforms are updated with one matmul per level of
+        the trees. Meshes below them, Textured or not, form a flat draw list
+        culled against the view frustum at once. Any other drawable, e.g. a
+        Node subclass with its own draw, is drawn as usual with the world
+        matrix of its parent row. Assigning the transform of a compiled node
+        updates its row at next draw, and any subtree change, see
+        Node.invalidate_bounds, recompiles the scene """
+    def __init__(self, *roots):
+        self.roots = roots
+        self.nodes, self.moved = [], []  # moved: nodes to update rows of
+        self.compile()
+
+    def compile(self):
+        """ Flatten the trees of roots into arrays and draw list """
+        nodes, parents, depths, items = [], [], [], []
+
+        def visit(children, parent, depth):
+            for child in children:
+                if isinstance(child, Node) and type(child).draw is Node.draw:
+                    nodes.append(child)
+                    parents.append(parent)
+                    depths.append(depth)
+                    visit(child.children, len(nodes), depth + 1)
+                else:
+                    items.append((parent, child))
+
+        self._revision = Node._revision
+        for node in self.nodes:
+            node._compiled = None
+        visit(self.roots, 0, 0)
+
+        # row 0 holds the model matrix the roots are drawn with, then rows
+        # of nodes by depth, so parents are computed before their children
+        order = np.argsort(depths, kind='stable')
+        row = np.zeros(len(nodes) + 1, np.intp)
+        row[order + 1] = np.arange(1, len(nodes) + 1)
+        self.nodes = [nodes[i] for i in order]
+        self.rows = {}  # node -> its rows, one per parent it appears below
+        for i, node in enumerate(nodes):
+            self.rows.setdefault(node, []).append(row[i + 1])
+        self.parents = np.zeros(len(nodes) + 1, np.intp)
+        self.parents[1:] = row[np.asarray(parents, np.intp)[order]]
+        depths = np.asarray(depths)[order]
+        bounds = np.flatnonzero(np.diff(depths)) + 1
+        self.levels = list(zip(np.r_[0, bounds] + 1,
+                               np.r_[bounds, len(nodes)] + 1))
+        self.local = np.empty((len(nodes) + 1, 4, 4), np.float32)
+        self.local[0] = identity()
+        self.local[1:] = np.reshape([node.transform for node in self.nodes],
+                                    (-1, 4, 4))
+        self.world = self.local.copy()
+        for node in self.nodes:
+            node._compiled = self
+        self.moved.clear()
+
+        # draw list, in traversal order; mesh boxes are culled at once
+        self.items = [(row[parent], drawable, self._is_mesh(drawable))
+                      for parent, drawable in items]
+        self.item_rows = np.array([item[0] for item in self.items], np.intp)
+        boxes = [(i, item[1].bounds) for i, item in enumerate(self.items)
+                 if item[2] and item[1].bounds is not None]
+        self.box_items = np.array([i for i, _ in boxes], np.intp)
+        lower, upper = (np.array([box[k] for _, box in boxes],
+                                 np.float32).reshape(-1, 3) for k in (0, 1))
+        self.box_centers, self.box_extents = (lower + upper) / 2, \
+            (upper - lower) / 2
+        self._model = None
+
+    @staticmethod
+    def _is_mesh(drawable):
+        """ True if drawable is drawn by Mesh.draw, possibly Textured """
+        if Textured is not None and type(drawable) is Textured:
+            drawable = drawable.drawable
+        return type(drawable).draw is Mesh.draw
+
+    def update(self, model):
+        """ Recompute world transforms of all rows below model matrix """
+        self.world[0] = model
+        for start, stop in self.levels:
+            np.matmul(self.world[self.parents[start:stop]],
+                      self.local[start:stop], out=self.world[start:stop])
+        frame_stats['matrices_recomputed'] += len(self.nodes)
+
+        # new matrix objects, drawables cache their work on model identity
+        self.models = list(self.world[self.item_rows])
+        matrices = self.world[self.item_rows[self.box_items]]
+        self.centers = np.einsum('nij,nj->ni', matrices[:, :3, :3],
+                                 self.box_centers) + matrices[:, :3, 3]
+        self.extents = np.einsum('nij,nj->ni', np.abs(matrices[:, :3, :3]),
+                                 self.box_extents)
+        self._model = model
+
+    def world_transforms(self, node):
+        """ (K, 4, 4) world transforms of a compiled node as of the last draw,
+            one per occurrence of the node in the trees """
+        return self.world[self.rows[node]]
+
+    def draw(self, model=identity(), frustum=None, **other_uniforms):
+        """ Draw the compiled trees, recompiled if they changed. Meshes out
+            of the optional frustum (a ViewFrustum) argument are skipped """
+        if self._revision != Node._revision:
+            self.compile()
+        if self.moved:
+            for node in dict.fromkeys(self.moved):
+                if node in self.rows:  # all its occurrences move with it
+                    self.local[self.rows[node]] = node.transform
+            self.moved.clear()
+            self._model = None
+        if model is not self._model:
+            self.update(model)
+
+        visible = np.ones(len(self.items), bool)
+        if frustum is not None and len(self.box_items):
+            visible[self.box_items] = frustum.intersects_all(self.centers,
+                                                             self.extents)
+        for (_, drawable, mesh), matrix, shown in zip(self.items, self.models,
+                                                       visible):
+            if not mesh:
+                drawable.draw(model=matrix, frustum=frustum, **other_uniforms)
+            elif shown:
+                drawable.draw(model=matrix, **other_uniforms)
+            else:
+                frame_stats['meshes_culled'] += 1
+
+    def key_handler(self, key):
+        """ Dispatch keyboard events to roots with key handler """
+        for root in (r for r in self.roots if hasattr(r, 'key_handler')):
+            root.key_handler(key)
+
+
 # -------------- 3D resource loader -------------------------------------------
 MAX_BONES = 128
 
 # optionally load texture module
 try:
-    from texture import Texture, Textured
+    from texture import Texture, TextureArray, Textured, load_image
 except ImportError:
-    Texture, Textured = None, None
+    Texture, TextureArray, Textured, load_image = None, None, None, None
 
 # optionally load animation module
 try:
@@ -194,83 +1084,123 @@ try:
 except ImportError:
     KeyFrameControlNode, Skinned = None, None
 
+# assimp post-processing applied to loaded files, part of the cache key
+_pp = assimpcy.aiPostProcessSteps
+LOAD_FLAGS = (_pp.aiProcess_JoinIdenticalVertices | _pp.aiProcess_FlipUVs
+              | _pp.aiProcess_OptimizeMeshes | _pp.aiProcess_Triangulate
+              | _pp.aiProcess_GenSmoothNormals
+              | _pp.aiProcess_ImproveCacheLocality
+              | _pp.aiProcess_RemoveRedundantMaterials)
+
+
+def skinning_weights(vertex_ids, bone_ids, weights, nb_vertices, count=4):
+    """ Bone ids and weights of the count most weighted bones of each vertex,
+        as two (nb_vertices, count) arrays, from flat arrays of (vertex, bone,
+        weight) triples. Rows are sorted by increasing weight, high weights
+        last, vertices with fewer bones are padded with null weights first """
+    order = np.lexsort((bone_ids, weights, vertex_ids))
+    vertex_ids = np.asarray(vertex_ids)[order]
+
+    # rank of each triple from the highest weight of its vertex, kept if small
+    ends = np.searchsorted(vertex_ids, vertex_ids, side='right')
+    rank = ends - 1 - np.arange(len(vertex_ids))
+    kept = rank < count
+    rows, columns = vertex_ids[kept], count - 1 - rank[kept]
+
+    ids = np.zeros((nb_vertices, count), np.uint32)
+    ids[rows, columns] = np.asarray(bone_ids)[order][kept]
+    top_weights = np.zeros((nb_vertices, count), np.float32)
+    top_weights[rows, columns] = np.asarray(weights)[order][kept]
+    return ids, top_weights
+
+
+def parse(file, flags=LOAD_FLAGS):
+    """ Parse file into a plain scene description: numpy arrays, lists and
+        dicts only, no OpenGL call. Served from the disk cache when the file
+        content, that of its material files and flags are unchanged, so a
+        warm start never calls assimp """
+    try:
+        key = file_hash(file, int(flags), *(
+            file_hash(dependency) if os.path.exists(dependency) else None
+            for dependency in _material_files(file)))
+    except OSError as exception:
+        print('ERROR loading', file + ': ', exception.strerror)
+        return None
+    scene = load_scene(key)
+    if scene is None:
+        scene = _import(file, flags)
+        if scene is not None:
+            try:
+                save_scene(key, scene)
+            except OSError as exception:
+                print('WARNING: cannot cache', file + ':', exception)
+    return scene
+
+
+def _material_files(file):
+    """ Files read by assimp along with file, whose content is part of the
+        parsed scene: the material libraries of Wavefront .obj files """
+    if os.path.splitext(file)[1].lower() != '.obj':
+        return []
+    with open(file, 'r', errors='replace') as stream:
+        names = [name for line in stream if line.startswith('mtllib')
+                 for name in line.split()[1:]]  # several files per line
+    return [os.path.join(os.path.dirname(file), name) for name in names]
 
-def load(file, shader, tex_file=None, **params):
-    """load resources from file using assimp, return node hierarchy """
+
+def _import(file, flags):
+    """ Run assimp on file and convert its scene to our description """
     try:
-        pp = assimpcy.aiPostProcessSteps
-        flags = pp.aiProcess_JoinIdenticalVertices | pp.aiProcess_FlipUVs
-        flags |= pp.aiProcess_OptimizeMeshes | pp.aiProcess_Triangulate
-        flags |= pp.aiProcess_GenSmoothNormals
-        flags |= pp.aiProcess_ImproveCacheLocality
-        flags |= pp.aiProcess_RemoveRedundantMaterials
         scene = assimpcy.aiImportFile(file, flags)
     except assimpcy.all.AssimpError as exception:
         print('ERROR loading', file + ': ', exception.args[0].decode())
-        return []
+        return None
 
-    # ----- Pre-load textures; embedded textures not supported at the moment
-    path = os.path.dirname(file) if os.path.dirname(file) != '' else './'
-    for mat in scene.mMaterials:
-        if not tex_file and 'TEXTURE_BASE' in mat.properties:  # texture token
-            name = mat.properties['TEXTURE_BASE'].split('/')[-1].split('\\')[-1]
-            # search texture in file's whole subdir since path often screwed up
-            paths = os.walk(path, followlinks=True)
-            file = next((os.path.join(d, f) for d, _, n in paths for f in n
-                     if name.startswith(f) or f.startswith(name)), None)
-            assert file, 'Cannot find texture %s in %s subtree' % (name, path)
-        if Texture is not None and file:
-            mat.properties['diffuse_map'] = Texture(tex_file=file)
+    # ----- materials, textures are kept as names and resolved when building
+    materials = [dict(
+        k_d=mat.get('COLOR_DIFFUSE', (1, 1, 1)),
+        k_s=mat.get('COLOR_SPECULAR', (1, 1, 1)),
+        k_a=mat.get('COLOR_AMBIENT', (0, 0, 0)),
+        s=mat.get('SHININESS', 16.),
+        texture=mat.get('TEXTURE_BASE', None),
+    ) for mat in (material.properties for material in scene.mMaterials)]
 
     # ----- load animations
     def conv(assimp_keys, ticks_per_second):
-        """ Conversion from assimp key struct to our dict representation """
-        return {key.mTime / ticks_per_second: key.mValue for key in assimp_keys}
+        """ Conversion from assimp key struct to (times, values) lists """
+        return ([key.mTime / ticks_per_second for key in assimp_keys],
+                [key.mValue for key in assimp_keys])
 
     # load first animation in scene file (could be a loop over all animations)
-    transform_keyframes = {}
+    animation = {}
     if scene.HasAnimations:
         anim = scene.mAnimations[0]
         for channel in anim.mChannels:
-            # for each animation bone, store TRS dict with {times: transforms}
-            transform_keyframes[channel.mNodeName] = (
+            # for each animation bone, store TRS keys as (times, values) pairs
+            animation[channel.mNodeName] = (
                 conv(channel.mPositionKeys, anim.mTicksPerSecond),
                 conv(channel.mRotationKeys, anim.mTicksPerSecond),
                 conv(channel.mScalingKeys, anim.mTicksPerSecond)
             )
 
-    # ---- prepare scene graph nodes
-    nodes = {}                                       # nodes name -> node lookup
-    nodes_per_mesh_id = [[] for _ in scene.mMeshes]  # nodes holding a mesh_id
-
-    def make_nodes(assimp_node):
-        """ Recursively builds nodes for our graph, matching assimp nodes """
-        keyframes = transform_keyframes.get(assimp_node.mName, None)
-        if keyframes and KeyFrameControlNode:
-            node = KeyFrameControlNode(*keyframes, assimp_node.mTransformation)
-        else:
-            node = Node(transform=assimp_node.mTransformation)
-        nodes[assimp_node.mName] = node
-        for mesh_index in assimp_node.mMeshes:
-            nodes_per_mesh_id[mesh_index] += [node]
-        node.add(*(make_nodes(child) for child in assimp_node.mChildren))
-        return node
+    # ----- node hierarchy, flattened in depth first order with root first
+    nodes = []
 
-    root_node = make_nodes(scene.mRootNode)
+    def flatten(assimp_node):
+        """ Recursively appends assimp node and its children to nodes list """
+        node_id = len(nodes)
+        nodes.append(dict(name=assimp_node.mName,
+                          transform=assimp_node.mTransformation,
+                          meshes=[int(i) for i in assimp_node.mMeshes]))
+        nodes[node_id]['children'] = [flatten(child)
+                                      for child in assimp_node.mChildren]
+        return node_id
 
-    # ---- create optionally decorated (Skinned, Textured) Mesh objects
-    for mesh_id, mesh in enumerate(scene.mMeshes):
-        # retrieve materials associated to this mesh
-        mat = scene.mMaterials[mesh.mMaterialIndex].properties
+    flatten(scene.mRootNode)
 
-        # initialize mesh with args from file, merge and override with params
-        index = mesh.mFaces
-        uniforms = dict(
-            k_d=mat.get('COLOR_DIFFUSE', (1, 1, 1)),
-            k_s=mat.get('COLOR_SPECULAR', (1, 1, 1)),
-            k_a=mat.get('COLOR_AMBIENT', (0, 0, 0)),
-            s=mat.get('SHININESS', 16.),
-        )
+    # ----- mesh vertex attributes and indices
+    meshes = []
+    for mesh in scene.mMeshes:
         attributes = dict(
             position=mesh.mVertices,
             normal=mesh.mNormals,
@@ -285,57 +1215,382 @@ def load(file, shader, tex_file=None, **params):
             attributes.update(color=mesh.mColors[0])
 
         # ---- compute and add optional skinning vertex attributes
+        bones, bone_offsets = [], None
         if mesh.HasBones:
             # skinned mesh: weights given per bone => convert per vertex for GPU
-            # first, populate an array with MAX_BONES entries per vertex
-            vbone = np.array([[(0, 0)] * MAX_BONES] * mesh.mNumVertices,
-                             dtype=[('weight', 'f4'), ('id', 'u4')])
-            for bone_id, bone in enumerate(mesh.mBones[:MAX_BONES]):
-                for entry in bone.mWeights:  # need weight,id pairs for sorting
-                    vbone[entry.mVertexId][bone_id] = (entry.mWeight, bone_id)
+            # gather flat (vertex, bone, weight) triples, then keep top 4
+            triples = np.array([(entry.mVertexId, bone_id, entry.mWeight)
+                                for bone_id, bone
+                                in enumerate(mesh.mBones[:MAX_BONES])
+                                for entry in bone.mWeights]).reshape(-1, 3)
+            ids, weights = skinning_weights(
+                triples[:, 0].astype(np.int64), triples[:, 1].astype(np.uint32),
+                triples[:, 2].astype(np.float32), mesh.mNumVertices)
+            attributes.update(bone_ids=ids, bone_weights=weights)
+            bones = [bone.mName for bone in mesh.mBones]
+            bone_offsets = np.array([bone.mOffsetMatrix
+                                     for bone in mesh.mBones], 'f')
+
+        meshes.append(dict(attributes=attributes, material=mesh.mMaterialIndex,
+                           index=np.asarray(mesh.mFaces, np.int32),
+                           bones=bones, bone_offsets=bone_offsets))
+
+    return dict(meshes=meshes, materials=materials, nodes=nodes,
+                animation=animation)
+
+
+def load(file, shader, tex_file=None, instances=None, texture_array=False,
+         compact=False, **params):
+    """load resources from file using assimp, return node hierarchy.
+    Loading a file again with the same shader, texture and params returns the
+    hierarchy built the first time; GPU buffers and textures are always shared.
+    With an (N, 4, 4) instances array of model matrices, meshes are built as
+    InstancedMesh and the whole set is drawn with one call per mesh.
+    With texture_array, textures of the file are layers of one TextureArray
+    per image size and meshes get a layer attribute: shader must sample the
+    diffuse_map with it, as fragment_shader_array.fs does.
+    With compact, vertex buffers use the compact formats of VertexArray:
+    shader must apply the dequantize matrix to positions, as
+    vertex_shader_objects.vs does.
+    """
+    def build():
+        prepared = _prepare(file, tex_file)
+        return _complete(_build(file, shader, params, instances,
+                                texture_array, compact, prepared))
+
+    if instances is not None:
+        root_node = build()
+    else:
+        root_node = resources.get(_model_key(file, shader, tex_file, params,
+                                             texture_array, compact), build)
+    return [root_node] if root_node is not None else []
+
+
+def _model_key(file, shader, tex_file, params, texture_array, compact):
+    """ Resource registry key of a loaded node hierarchy """
+    return ('model', os.path.abspath(file), shader.glid, tex_file,
+            int(LOAD_FLAGS), _params_key(params), texture_array, compact)
+
+
+def _params_key(params):
+    """ Hashable summary of uniform params, for resource registry keys """
+    return tuple(sorted((name, repr(np.asarray(value).tolist()))
+                        for name, value in params.items()))
+
+
+def _complete(steps):
+    """ Run a generator to its end, returns its return value """
+    while True:
+        try:
+            next(steps)
+        except StopIteration as stop:
+            return stop.value
+
+
+def _prepare(file, tex_file=None, decode=False):
+    """ CPU side of loading, without any OpenGL call so that it can run in a
+        worker thread: parse file, locate its textures and optionally decode
+        those not already loaded. Returns None if file cannot be parsed """
+    scene = parse(file)
+    if scene is None:
+        return None
+
+    # ----- locate textures; embedded textures not supported at the moment
+    path = os.path.dirname(file) if os.path.dirname(file) != '' else './'
+    texture_files = []
+    for mat in scene['materials']:
+        texture_file = tex_file
+        if not tex_file and mat['texture']:  # texture token
+            name = mat['texture'].split('/')[-1].split('\\')[-1]
+            # search texture in file's whole subdir since path often screwed up
+            paths = os.walk(path, followlinks=True)
+            texture_file = next((os.path.join(d, f) for d, _, n in paths
+                                 for f in n
+                                 if name.startswith(f) or f.startswith(name)),
+                                None)
+            assert texture_file, 'Cannot find texture %s in %s subtree' % (
+                name, path)
+        texture_files.append(os.path.abspath(texture_file)
+                             if Texture is not None and texture_file else None)
+
+    images = {}  # texture file -> decoded mip levels, see texture.load_image
+    if decode:
+        for texture_file in set(texture_files) - {None}:
+            if ('texture', texture_file) not in resources.entries:
+                try:
+                    images[texture_file] = load_image(texture_file)
+                except FileNotFoundError:
+                    pass  # reported when creating the texture
+    return dict(scene=scene, texture_files=texture_files, images=images)
+
+
+def _build(file, shader, params, instances, texture_array, compact,
+           prepared):
+    """ Build node hierarchy and GL resources from the prepared description of
+        file. Generator yielding after each GL upload, so that uploads can be
+        spread over frames; returns the root node """
+    if prepared is None:
+        return None
+    scene = prepared['scene']
+    texture_files, images = prepared['texture_files'], prepared['images']
+    saved_before = memory_stats['buffer_bytes_saved']  # builds are sequential
+
+    # ----- create textures, shared with other files using the same images
+    textures = []
+    texture_array = texture_array and TextureArray is not None
+    if texture_array:
+        # one array per image size, not to resize images to a common size
+        files = list(dict.fromkeys(f for f in texture_files if f is not None))
+        layers, arrays = {}, {}
+        for group in TextureArray.size_groups(files, images):
+            array = resources.get(('texture_array',) + tuple(group),
+                                  lambda: TextureArray(group, images=images))
+            for layer, texture_file in enumerate(group):
+                layers[texture_file], arrays[texture_file] = layer, array
+            yield
+        textures = [arrays.get(f) for f in texture_files]
+    else:
+        for texture_file in texture_files:
+            if texture_file is not None:
+                image = images.get(texture_file)
+                textures.append(resources.get(
+                    ('texture', texture_file),
+                    lambda: Texture(tex_file=texture_file, image=image)))
+                yield
+            else:
+                textures.append(None)
+
+    # ----- animations, as keyframe dicts of {times: transforms}
+    transform_keyframes = {
+        name: tuple(dict(zip(times, (np.asarray(v) for v in values)))
+                    for times, values in channel)
+        for name, channel in scene['animation'].items()
+    }
+
+    # ---- prepare scene graph nodes
+    nodes = {}                                       # nodes name -> node lookup
+    nodes_per_mesh_id = [[] for _ in scene['meshes']]  # nodes holding a mesh_id
+    matrices = {}                                    # node -> matrix of file
+
+    # without animation, meshes are merged into a few batches, see below
+    static = not scene['animation'] and not any(
+        mesh['bones'] for mesh in scene['meshes'])
+    parts = []                  # merge_meshes parts of a static file
+
+    def make_nodes(node_id, matrix=None):
+        """ Recursively builds nodes for our graph, matching assimp nodes """
+        description = scene['nodes'][node_id]
+        transform = np.array(description['transform'], 'f')
+        keyframes = transform_keyframes.get(description['name'], None)
+        if keyframes and KeyFrameControlNode:
+            node = KeyFrameControlNode(*keyframes, transform)
+        else:
+            node = Node(transform=transform)
+        node.name = description['name']
+        nodes[description['name']] = node
+        matrices[node] = transform if matrix is None else matrix @ transform
+        for mesh_index in description['meshes']:
+            nodes_per_mesh_id[mesh_index] += [node]
+        node.add(*(make_nodes(child, matrices[node])
+                   for child in description['children']))
+        return node
 
-            vbone.sort(order='weight')   # sort rows, high weights last
-            vbone = vbone[:, -4:]        # limit bone size, keep highest 4
+    root_node = make_nodes(0)
 
-            attributes.update(bone_ids=vbone['id'],
-                              bone_weights=vbone['weight'])
+    # ---- create optionally decorated (Skinned, Textured) Mesh objects
+    for mesh_id, mesh in enumerate(scene['meshes']):
+        # retrieve materials associated to this mesh
+        mat = scene['materials'][mesh['material']]
+        texture = textures[mesh['material']]
 
-        new_mesh = Mesh(shader=shader, attributes=attributes,
-                        uniforms={**uniforms, **params}, index=index)
+        # texture array layer of the mesh, as a constant vertex attribute
+        attributes = mesh['attributes']
+        if texture_array and texture is not None:
+            layer = layers[texture_files[mesh['material']]]
+            attributes = dict(attributes, layer=np.full(
+                (len(attributes['position']), 1), layer, np.float32))
 
-        if Textured is not None and 'diffuse_map' in mat:
-            new_mesh = Textured(new_mesh, diffuse_map=mat['diffuse_map'])
-        if Skinned and mesh.HasBones:
+        # initialize mesh with args from file, merge and override with params
+        uniforms = {k: mat[k] for k in ('k_d', 'k_s', 'k_a', 's')}
+        if static:
+            textured = Textured is not None and texture is not None
+            parts += [(matrices[node], shader, attributes, mesh['index'],
+                       {**uniforms, **params},
+                       dict(diffuse_map=texture) if textured else {})
+                      for node in nodes_per_mesh_id[mesh_id]]
+            continue
+        if instances is not None:  # instance buffer is specific to this load
+            new_mesh = InstancedMesh(shader, attributes, instances,
+                                     {**uniforms, **params}, mesh['index'],
+                                     compact=compact)
+            yield
+        else:
+            vertex_array = resources.get(
+                ('vertex_array', os.path.abspath(file), int(LOAD_FLAGS),
+                 mesh_id, shader.glid, texture_array, compact),
+                lambda: VertexArray(shader, attributes, mesh['index'],
+                                    compact=compact))
+            new_mesh = Mesh(shader=shader, attributes=attributes,
+                            uniforms={**uniforms, **params},
+                            index=mesh['index'], vertex_array=vertex_array)
+            yield
+
+        if Textured is not None and texture is not None:
+            new_mesh = Textured(new_mesh, diffuse_map=texture)
+        if Skinned and mesh['bones']:
             # make bone lookup array & offset matrix, indexed by bone index (id)
-            bone_nodes = [nodes[bone.mName] for bone in mesh.mBones]
-            bone_offsets = [bone.mOffsetMatrix for bone in mesh.mBones]
-            new_mesh = Skinned(new_mesh, bone_nodes, bone_offsets)
+            bone_nodes = [nodes[bone] for bone in mesh['bones']]
+            new_mesh = Skinned(new_mesh, bone_nodes, mesh['bone_offsets'])
         for node_to_populate in nodes_per_mesh_id[mesh_id]:
             node_to_populate.add(new_mesh)
 
-    nb_triangles = sum((mesh.mNumFaces for mesh in scene.mMeshes))
+    if static:  # nodes were only needed for their transform
+        # part matrices hold the root transform: instances apply after it
+        root_node.children = merge_meshes(parts, instances, compact)
+        root_node.transform = identity()
+        root_node.invalidate_bounds()
+        yield
+
+    nb_triangles = sum((len(mesh['index']) for mesh in scene['meshes']))
     print('Loaded', file, '\t(%d meshes, %d faces, %d nodes, %d animations)' %
-          (scene.mNumMeshes, nb_triangles, len(nodes), scene.mNumAnimations))
-    return [root_node]
+          (len(scene['meshes']), nb_triangles, len(nodes),
+           1 if scene['animation'] else 0))
+    if compact:
+        saved = memory_stats['buffer_bytes_saved'] - saved_before
+        print('\tcompact vertex formats saved %d KB' % (saved // 1024))
+    return root_node
+
+
+class Placeholder(Node):
+    """ Node standing for a hierarchy being loaded, see AsyncLoader. Until it
+        is populated, optional bounds stand for those of its future content """
+    animated = True  # bounds change once loaded, parents must not cache them
+
+    def __init__(self, bounds=None, **kwargs):
+        super().__init__(**kwargs)
+        self.placeholder_bounds = bounds
+
+    def add(self, *drawables):
+        """ Populate the placeholder, whose bounds are then cacheable """
+        self.animated = False
+        super().add(*drawables)
+
+    @property
+    def content_bounds(self):
+        if not self.children:
+            return self.placeholder_bounds
+        return super().content_bounds
+
+
+class AsyncLoader:
+    """ Loads files without stalling rendering: parsing and image decoding
+        run in a thread pool, then the render thread creates GL resources in
+        step(), at most budget seconds per frame. load() immediately returns
+        a placeholder node, populated when its file is loaded """
+    def __init__(self, workers=4, budget=0.004, progress=None):
+        """ progress is called with (loaded, total, file) for each file """
+        self.pool = ThreadPoolExecutor(workers)
+        self.budget, self.progress = budget, progress
+        self.pending = []     # (future, placeholder, file, build args, key)
+        self.building = None  # (placeholder, file, key, build steps)
+        self.loaded, self.total = 0, 0
+
+    def load(self, file, shader, tex_file=None, instances=None,
+             texture_array=False, compact=False, bounds=None, **params):
+        """ Same as load(), except that it returns a placeholder node right
+            away, culled with optional bounds until loaded """
+        placeholder = Placeholder(bounds, name=os.path.basename(file))
+        self.total += 1
+        key = None if instances is not None \
+            else _model_key(file, shader, tex_file, params, texture_array,
+                            compact)
+        root_node = resources.entries.get(key) if key is not None else None
+        if root_node is not None:  # already loaded, shared right away
+            placeholder.add(root_node)
+            self._loaded(file)
+        else:
+            future = self.pool.submit(_prepare, file, tex_file, decode=True)
+            self.pending.append((future, placeholder, file,
+                                 (file, shader, params, instances,
+                                  texture_array, compact), key))
+        return [placeholder]
+
+    @property
+    def done(self):
+        return self.loaded == self.total
+
+    def _loaded(self, file):
+        self.loaded += 1
+        if self.progress is not None:
+            self.progress(self.loaded, self.total, file)
+
+    def step(self, budget=None):
+        """ Create GL resources of files ready to build, for at most budget
+            seconds, default to the loader budget """
+        deadline = time.perf_counter() + (budget or self.budget)
+        while time.perf_counter() < deadline:
+            if self.building is None:
+                ready = [entry for entry in self.pending if entry[0].done()]
+                if not ready:
+                    return
+                self.pending.remove(ready[0])
+                future, placeholder, file, args, key = ready[0]
+                steps = _build(*args, future.result())
+                self.building = (placeholder, file, key, steps)
+
+            placeholder, file, key, steps = self.building
+            try:
+                next(steps)
+                continue
+            except StopIteration as stop:
+                root_node = stop.value
+            self.building = None
+            if root_node is not None:
+                if key is not None:  # another load may have been faster
+                    root_node = resources.get(key, lambda: root_node)
+                placeholder.add(root_node)
+            self._loaded(file)
+
+    def finish(self):
+        """ Block until all scheduled files are loaded """
+        while not self.done:
+            self.step(float('inf'))
+            if not self.done:
+                time.sleep(0.001)  # wait for workers
 
 
 # ------------  Viewer class & window management ------------------------------
 class Viewer(Node):
     """ GLFW viewer window, with classic initialization & graphics loop """
 
-    def __init__(self, width=640, height=480):
+    def __init__(self, width=640, height=480, sort_draws=True, headless=False):
+        """ sort_draws submits meshes through a DrawQueue sorted by render
+            state, instead of drawing them in scene traversal order.
+            headless renders to an offscreen framebuffer of an invisible
+            window, see benchmark; with PYOPENGL_PLATFORM=egl or osmesa, this
+            works without any display """
         super().__init__()
+        self.queue = DrawQueue() if sort_draws else None
+        self.loader = None  # optional AsyncLoader, stepped once per frame
 
         # version hints: create GL window with >= OpenGL 3.3 and core profile
         glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
         glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
         glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, GL.GL_TRUE)
         glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
-        glfw.window_hint(glfw.RESIZABLE, True)
+        glfw.window_hint(glfw.RESIZABLE, not headless)
+        glfw.window_hint(glfw.VISIBLE, not headless)
+        if HEADLESS_API is not None:
+            glfw.window_hint(glfw.CONTEXT_CREATION_API, HEADLESS_API)
         self.win = glfw.create_window(width, height, 'Viewer', None, None)
 
         # make win's OpenGL context current; no OpenGL calls can happen before
         glfw.make_context_current(self.win)
+        self.framebuffer = Framebuffer(width, height) if headless else None
+
+        # per-frame camera data, shared by all shader programs
+        self.camera = UniformBlock('Camera', view='mat4', projection='mat4',
+                                   w_camera_position='vec3')
 
         # initialize trackball
         self.trackball = Trackball()
@@ -360,20 +1615,33 @@ class Viewer(Node):
         # cyclic iterator to easily toggle polygon rendering modes
         self.fill_modes = cycle([GL.GL_LINE, GL.GL_POINT, GL.GL_FILL])
 
+    def render(self, win_size):
+        """ Draw one frame of the scene, for a window of given size """
+        if self.loader is not None:
+            self.loader.step()
+
+        # clear draw buffer and depth buffer (<-TP2)
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+
+        # draw our scene objects, skipping those out of view
+        frame_stats.clear()
+        view = self.trackball.view_matrix()
+        projection = self.trackball.projection_matrix(win_size)
+        cam_pos = np.linalg.inv(view)[:, 3]
+        self.camera.update(view=view, projection=projection,
+                           w_camera_position=cam_pos)
+        self.draw(view=view,  # default model, unchanged world transforms
+                  projection=projection,
+                  w_camera_position=cam_pos,
+                  frustum=ViewFrustum(projection @ view),
+                  queue=self.queue)
+        if self.queue is not None:
+            self.queue.flush()
+
     def run(self):
         """ Main render loop for this OpenGL window """
         while not glfw.window_should_close(self.win):
-            # clear draw buffer and depth buffer (<-TP2)
-            GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
-
-            win_size = glfw.get_window_size(self.win)
-
-            # draw our scene objects
-            cam_pos = np.linalg.inv(self.trackball.view_matrix())[:, 3]
-            self.draw(view=self.trackball.view_matrix(),
-                      projection=self.trackball.projection_matrix(win_size),
-                      model=identity(),
-                      w_camera_position=cam_pos)
+            self.render(glfw.get_window_size(self.win))
 
             # flush render commands, and swap draw buffers
             glfw.swap_buffers(self.win)
@@ -381,6 +1649,46 @@ class Viewer(Node):
             # Poll for and process events
             glfw.poll_events()
 
+    def benchmark(self, frames=100, frame_time=1 / 60, warmup=10,
+                  on_frame=None):
+        """ Render warmup then frames frames, with a simulated clock advancing
+            by frame_time seconds per frame so animations are reproducible.
+            Optional on_frame is called with the simulated time before each
+            frame, e.g. to move the camera along a path.
+            Returns a dict per measured frame: simulated time, CPU time to
+            submit the frame, GPU time from a GL_TIME_ELAPSED query, and the
+            frame_stats counters, e.g. draw_calls """
+        if self.framebuffer is not None:
+            self.framebuffer.bind()
+            win_size = self.framebuffer.size
+        else:
+            win_size = glfw.get_window_size(self.win)
+        queries = GL.glGenQueries(frames)
+        records = []
+        for frame in range(-warmup, frames):
+            glfw.set_time(max(frame, 0) * frame_time)
+            if on_frame is not None:
+                on_frame(max(frame, 0) * frame_time)
+            if frame >= 0:
+                GL.glBeginQuery(GL.GL_TIME_ELAPSED, queries[frame])
+            start = time.perf_counter()
+            self.render(win_size)
+            cpu_time = time.perf_counter() - start
+            if frame >= 0:
+                GL.glEndQuery(GL.GL_TIME_ELAPSED)
+                records.append(dict(frame=frame, time=frame * frame_time,
+                                    cpu_ms=cpu_time * 1000, **frame_stats))
+            if self.framebuffer is None:
+                glfw.swap_buffers(self.win)
+            glfw.poll_events()
+
+        # results are read once all frames are submitted, not to stall the GPU
+        for record, query in zip(records, queries):
+            elapsed = GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT)
+            record['gpu_ms'] = int(elapsed) / 1e6
+        GL.glDeleteQueries(frames, queries)
+        return records
+
     def on_key(self, _win, key, _scancode, action, _mods):
         """ 'Q' or 'Escape' quits """
         if action == glfw.PRESS or action == glfw.REPEAT:
@@ -1,6 +1,10 @@
 #version 330 core
 
-uniform vec3 w_camera_position;
+layout (std140) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
 uniform sampler2D diffuse_map;
 //uniform vec3 k_a, k_s;
 vec3 k_a = vec3(0);
@@ -10,10 +14,12 @@ in vec2 frag_tex_coords;
 out vec4 out_color;
 
 // light
-uniform vec3 light_dir;
-uniform vec3 light_ambient;
-uniform vec3 light_diffuse;
-uniform vec3 light_specular;
+layout (std140) uniform Light {
+    vec3 light_dir;
+    vec3 light_ambient;
+    vec3 light_diffuse;
+    vec3 light_specular;
+};
 
 void main() {
     vec3 k_d = texture(diffuse_map, frag_tex_coords).xyz;
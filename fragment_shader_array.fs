@@ -0,0 +1,42 @@
+#version 330 core
+
+layout (std140) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
+uniform sampler2DArray diffuse_map;  // see texture.TextureArray
+//uniform vec3 k_a, k_s;
+vec3 k_a = vec3(0);
+vec3 k_s = vec3(0);
+in vec3 w_position, w_normal;
+in vec2 frag_tex_coords;
+flat in float frag_layer;
+out vec4 out_color;
+
+// light
+layout (std140) uniform Light {
+    vec3 light_dir;
+    vec3 light_ambient;
+    vec3 light_diffuse;
+    vec3 light_specular;
+};
+
+void main() {
+    vec3 k_d = texture(diffuse_map, vec3(frag_tex_coords, frag_layer)).xyz;
+    vec3 n = normalize(w_normal);
+    vec3 l = normalize(light_dir);
+    float d = max(0, dot(n, l));
+    vec3 ref = reflect(-l, n);
+    vec3 r = normalize(ref);
+    vec3 vec = w_camera_position - w_position;
+    vec3 v = normalize(vec);
+    float sp = pow(max(0, dot(r, v)), 5);
+
+    vec3 ambiant = light_ambient * k_a;
+    vec3 diffuse = light_diffuse * d * k_d;
+    vec3 specular = light_specular * sp * k_s;
+
+    vec3 I = light_ambient + diffuse + specular;
+    out_color = vec4(I, 1);
+}
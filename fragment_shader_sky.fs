@@ -1,6 +1,10 @@
 #version 330 core
 
-uniform vec3 w_camera_position;
+layout (std140) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
 uniform sampler2D diffuse_map;
 in vec3 w_position, w_normal;
 in vec2 frag_tex_coords;
@@ -0,0 +1,237 @@
+"""
+Opt-in per node profiling of the scene graph: while a Profiler is enabled, the
+draw methods of Node, Mesh, Textured and their subclasses are wrapped to record
+the CPU wall time and GPU time of each drawn object, named after its node.
+When disabled, the original methods are restored and nothing is measured.
+
+    with Profiler() as profiler:
+        viewer.benchmark(100)
+    print(profiler.report())
+    profiler.export_chrome_trace("trace.json")
+
+GPU times are measured with GL_TIMESTAMP queries around each draw, read back
+once available, a few frames later, not to stall the GPU. With a DrawQueue,
+meshes only record their draws during traversal: the draw calls submitted by
+DrawQueue.flush are timed as "(queued)" spans below the node that drew them.
+"""
+
+import functools
+import json
+import time
+
+import OpenGL.GL as GL  # standard Python OpenGL wrapper
+
+from core import Node, Mesh, DrawQueue, Viewer, CompiledScene
+from texture import Textured
+
+
+def _subclasses(cls):
+    """cls and all its currently defined subclasses"""
+    yield cls
+    for subclass in cls.__subclasses__():
+        yield from _subclasses(subclass)
+
+
+class Profiler:
+    """Records a hierarchy of spans per frame, a frame being one top level
+    draw, e.g. Viewer.render. Classes defined after enable() are not wrapped"""
+
+    def __init__(self):
+        self.frames = []  # per frame list of spans, see _end_frame()
+        self.stack = []  # open spans as [object, path, cpu start, query]
+        self.spans = []  # closed spans of the current frame
+        self.queries = []  # free GL query objects
+        self.patched = []  # (class, method name, original method)
+        self.pending = []  # closed frame spans, waiting for their queries
+
+    # -------------- method wrapping -----------------------------------------
+    def enable(self):
+        """wrap draw methods of scene classes, and Viewer.render as frame"""
+        targets = [
+            (Viewer, "render", "frame"),
+            (DrawQueue, "flush", None),
+            (CompiledScene, "draw", None),
+        ]
+        for base in (Node, Mesh, Textured):
+            targets += [
+                (cls, "draw", None) for cls in _subclasses(base) if "draw" in vars(cls)
+            ]
+        for cls, name, label in targets:
+            method = vars(cls)[name]
+            self.patched.append((cls, name, method))
+            setattr(cls, name, self._wrap(method, label))
+
+        # queued draws are timed at flush, below the node that drew them
+        for name, wrap in (("add", self._wrap_add), ("execute", self._wrap_execute)):
+            method = vars(DrawQueue)[name]
+            self.patched.append((DrawQueue, name, method))
+            setattr(DrawQueue, name, wrap(method))
+
+    def disable(self):
+        """restore the original methods, and wait for pending GPU times"""
+        for cls, name, method in reversed(self.patched):
+            setattr(cls, name, method)
+        self.patched.clear()
+        self._resolve(wait=True)
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exception):
+        self.disable()
+
+    def _wrap(self, method, label):
+        @functools.wraps(method)
+        def wrapper(obj, *args, **kwargs):
+            # super().draw() calls of a subclass stay in the caller's span
+            if self.stack and self.stack[-1][0] is obj:
+                return method(obj, *args, **kwargs)
+            self.begin(obj, label)
+            try:
+                return method(obj, *args, **kwargs)
+            finally:
+                self.end()
+
+        return wrapper
+
+    def _wrap_add(self, method):
+        @functools.wraps(method)
+        def wrapper(queue, mesh, primitives, uniforms, source=None):
+            if source is None and self.stack:
+                source = self.stack[-1][1]
+            return method(queue, mesh, primitives, uniforms, source)
+
+        return wrapper
+
+    def _wrap_execute(self, method):
+        @functools.wraps(method)
+        def wrapper(queue, mesh, primitives, bind, source):
+            self.begin(mesh, path=source and source + ("(queued)",))
+            try:
+                return method(queue, mesh, primitives, bind, source)
+            finally:
+                self.end()
+
+        return wrapper
+
+    # -------------- span recording ------------------------------------------
+    def begin(self, obj, label=None, path=None):
+        """open a span for obj, labelled by its node name or class name, below
+        the innermost open span unless a path is given"""
+        if path is None:
+            label = label or getattr(obj, "name", None) or type(obj).__name__
+            path = (self.stack[-1][1] if self.stack else ()) + (label,)
+        query = self.queries.pop() if self.queries else GL.glGenQueries(1)[0]
+        GL.glQueryCounter(query, GL.GL_TIMESTAMP)
+        self.stack.append([obj, path, time.perf_counter_ns(), query])
+
+    def end(self):
+        """close the innermost span, and the frame with the last span"""
+        _, path, cpu_start, start_query = self.stack.pop()
+        cpu_end = time.perf_counter_ns()
+        end_query = self.queries.pop() if self.queries else GL.glGenQueries(1)[0]
+        GL.glQueryCounter(end_query, GL.GL_TIMESTAMP)
+        self.spans.append((path, cpu_start, cpu_end, start_query, end_query))
+        if not self.stack:
+            self._end_frame()
+
+    def _end_frame(self):
+        """queue the frame spans, resolved once the GPU reaches their end"""
+        self.pending.append(self.spans)
+        self.spans = []
+        self._resolve()
+
+    def _resolve(self, wait=False):
+        """resolve GPU timestamps of the pending frames whose queries are
+        available, all of them if wait, in traversal order"""
+        while self.pending:
+            spans = self.pending[0]
+            last = spans[-1][-1]  # frame span closes, and is queried, last
+            available = GL.glGetQueryObjectuiv(last, GL.GL_QUERY_RESULT_AVAILABLE)
+            if not wait and not int(available):
+                return
+            self.pending.pop(0)
+            frame = []
+            spans.sort(key=lambda span: span[1])  # spans close child first
+            for path, cpu_start, cpu_end, *queries in spans:
+                gpu_start, gpu_end = (
+                    int(GL.glGetQueryObjectui64v(query, GL.GL_QUERY_RESULT))
+                    for query in queries
+                )
+                self.queries += queries
+                frame.append(
+                    dict(
+                        path=path,
+                        cpu_start=cpu_start,
+                        cpu_ns=cpu_end - cpu_start,
+                        gpu_start=gpu_start,
+                        gpu_ns=gpu_end - gpu_start,
+                    )
+                )
+            self.frames.append(frame)
+
+    # -------------- reports -------------------------------------------------
+    def report(self):
+        """table of calls, CPU and GPU milliseconds per frame for each node,
+        indented by depth in the scene graph"""
+        self._resolve(wait=True)
+        rows = {}  # path -> [calls, cpu ns, gpu ns], in first traversal order
+        for frame in self.frames:
+            for span in frame:
+                row = rows.setdefault(span["path"], [0, 0, 0])
+                row[0] += 1
+                row[1] += span["cpu_ns"]
+                row[2] += span["gpu_ns"]
+        # queued draws are timed after traversal, list them below their node
+        order = {path: index for index, path in enumerate(rows)}
+        paths = sorted(
+            rows,
+            key=lambda path: [
+                order.get(path[:depth], -1) for depth in range(1, len(path) + 1)
+            ],
+        )
+        count = max(len(self.frames), 1)
+        lines = ["%-48s %8s %10s %10s" % ("node", "calls", "cpu ms", "gpu ms")]
+        for path in paths:
+            calls, cpu_ns, gpu_ns = rows[path]
+            name = "  " * (len(path) - 1) + path[-1]
+            lines.append(
+                "%-48s %8.1f %10.3f %10.3f"
+                % (name[:48], calls / count, cpu_ns / count / 1e6, gpu_ns / count / 1e6)
+            )
+        lines.append("%d frames, times are means per frame" % len(self.frames))
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, file):
+        """write spans as Chrome trace events, viewable in chrome://tracing or
+        Perfetto: CPU spans on one track, GPU spans on another, aligned on the
+        CPU start of each frame"""
+        self._resolve(wait=True)
+        events = [
+            dict(name="thread_name", ph="M", pid=0, tid=tid, args=dict(name=name))
+            for tid, name in ((0, "CPU"), (1, "GPU"))
+        ]
+        origin = self.frames[0][0]["cpu_start"] if self.frames else 0
+        for frame in self.frames:
+            cpu_origin, gpu_origin = frame[0]["cpu_start"], frame[0]["gpu_start"]
+            for span in frame:
+                args = dict(path="/".join(span["path"]))
+                gpu_start = span["gpu_start"] - gpu_origin + cpu_origin
+                for tid, start, duration in (
+                    (0, span["cpu_start"], span["cpu_ns"]),
+                    (1, gpu_start, span["gpu_ns"]),
+                ):
+                    events.append(
+                        dict(
+                            name=span["path"][-1],
+                            ph="X",
+                            pid=0,
+                            tid=tid,
+                            ts=(start - origin) / 1e3,
+                            dur=duration / 1e3,
+                            args=args,
+                        )
+                    )
+        with open(file, "w") as stream:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), stream)
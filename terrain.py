@@ -0,0 +1,201 @@
+"""
+Desert terrain helpers: vectorized grid mesh construction, and NumPy version
+of the desert noise of vertex_shader_desert.vs, used to bake the terrain once
+on the CPU instead of evaluating it per vertex per frame.
+"""
+
+import numpy as np  # vectorized noise evaluation
+
+# fNoise parameters used by the desert shader
+AMPLITUDE, FREQUENCY, PERSISTENCE, OCTAVES = 20.0, 0.02, 0.1, 15
+MAX_HEIGHT = AMPLITUDE / (1 - PERSISTENCE)  # bound of the noise value
+
+_HASH_DIRECTION = np.array((12.9898, 78.233, 45.5432), np.float32)
+
+
+def hash31(p):
+    """hash31 of the shader, for an (..., 3) array of points"""
+    dot = p @ _HASH_DIRECTION
+    value = np.sin(dot) * np.float32(43758.5453123)
+    return value - np.floor(value)
+
+
+def value_noise(p):
+    """vNoise of the shader and its analytic gradient, for (..., 3) points.
+    Returns the (...) noise values and the (..., 3) gradient"""
+    c = np.floor(p)
+    f = p - c
+    u = f * f * (3 - 2 * f)  # smoothstep weights and their derivative
+    du = 6 * f * (1 - f)
+
+    def corner(x, y, z):
+        return hash31(c + np.array((x, y, z), np.float32))
+
+    # mixes along x for the 4 edges, the y=1 layer is skipped on y=0 planes
+    def edges(y, z):
+        v0, v1 = corner(0, y, z), corner(1, y, z)
+        return v0 + (v1 - v0) * u[..., 0], v1 - v0
+
+    m1x, d1x = edges(0, 0)
+    m3x, d3x = edges(0, 1)
+    if np.any(u[..., 1]):
+        m2x, d2x = edges(1, 0)
+        m4x, d4x = edges(1, 1)
+    else:
+        (m2x, d2x), (m4x, d4x) = (m1x, d1x), (m3x, d3x)
+
+    uy, uz = u[..., 1], u[..., 2]
+    m5y = m1x + (m2x - m1x) * uy
+    m6y = m3x + (m4x - m3x) * uy
+    value = m5y + (m6y - m5y) * uz
+
+    gradient = np.empty(p.shape, np.float32)
+    dx_y0, dx_y1 = d1x + (d2x - d1x) * uy, d3x + (d4x - d3x) * uy
+    gradient[..., 0] = du[..., 0] * (dx_y0 + (dx_y1 - dx_y0) * uz)
+    gradient[..., 1] = du[..., 1] * ((m2x - m1x) + ((m4x - m3x) - (m2x - m1x)) * uz)
+    gradient[..., 2] = du[..., 2] * (m6y - m5y)
+    return value, gradient
+
+
+def fractal_noise(p, amp=AMPLITUDE, freq=FREQUENCY, pers=PERSISTENCE, octaves=OCTAVES):
+    """fNoise of the shader and its analytic gradient, for (..., 3) points"""
+    p = np.asarray(p, np.float32)
+    value = np.zeros(p.shape[:-1], np.float32)
+    gradient = np.zeros(p.shape, np.float32)
+    for _ in range(octaves):
+        octave, octave_gradient = value_noise(p * np.float32(freq))
+        value += octave * np.float32(amp)
+        gradient += octave_gradient * np.float32(amp * freq)
+        freq, amp = freq * 2, amp * pers
+    return value, gradient
+
+
+def heightfield(x, z):
+    """Desert heights and unit normals at points of the y=0 plane"""
+    points = np.stack((x, np.zeros_like(x), z), axis=-1)
+    height, gradient = fractal_noise(points)
+    normal = np.stack((-gradient[..., 0], np.ones_like(height), -gradient[..., 2]), -1)
+    normal /= np.linalg.norm(normal, axis=-1, keepdims=True)
+    return height, normal
+
+
+# -------------- grid mesh construction --------------------------------------
+RESTART_INDEX = {np.uint16: 0xFFFF, np.uint32: 0xFFFFFFFF}
+
+
+def grid_positions(N, size):
+    """(N*N, 3) positions of a N x N vertex grid centered on the y=0 plane,
+    in row major order: vertex (row j, column i) has index j * N + i"""
+    axis = np.linspace(-size / 2, size / 2, N, dtype=np.float32)
+    position = np.zeros((N, N, 3), np.float32)
+    position[..., 0] = axis[np.newaxis, :]
+    position[..., 2] = axis[:, np.newaxis]
+    return position.reshape(-1, 3)
+
+
+def grid_index(N, mode="triangles"):
+    """Index buffer for a N x N vertex grid, with one of the modes:
+        - "triangles": uint32 triangle list, 6 indices per cell
+        - "strip": uint32 triangle strips, one per row of cells, separated by
+          the primitive restart index, 2 indices per vertex
+        - "strip16": as "strip" but uint16, for a band of rows small enough
+          to be addressed with 16 bits; the band is drawn once per band of
+          the grid with a base vertex offset
+    Returns the index array and the list of (first, count, base_vertex)
+    ranges to draw, None meaning the whole buffer at once"""
+    if mode == "triangles":
+        rows = np.arange(N - 1, dtype=np.uint32)[:, np.newaxis] * N
+        a = (rows + np.arange(N - 1, dtype=np.uint32)).ravel()
+        b, c = a + 1, a + N  # right and next row neighbours of a
+        return np.stack((a, c, b, c, c + 1, b), axis=-1).ravel(), None
+
+    if mode == "strip":
+        return _strips(N, N - 1, np.uint32), None
+
+    if mode == "strip16":
+        # rows of a band must be addressable, restart index excluded
+        band = min(N - 1, (RESTART_INDEX[np.uint16] - N) // N)
+        assert band > 0, "grid too wide for 16 bit indices"
+        index = _strips(N, band, np.uint16)
+        per_row = 2 * N + 1
+        ranges = [
+            (0, min(band, N - 1 - row) * per_row, row * N)
+            for row in range(0, N - 1, band)
+        ]
+        return index, ranges
+
+    raise ValueError("unknown grid index mode %r" % mode)
+
+
+def _strips(N, rows, dtype):
+    """Triangle strips for rows of cells, each followed by a restart index"""
+    strips = np.empty((rows, 2 * N + 1), dtype)
+    start = np.arange(rows, dtype=dtype)[:, np.newaxis] * dtype(N)
+    strips[:, 0:-1:2] = start + np.arange(N, dtype=dtype)
+    strips[:, 1:-1:2] = strips[:, 0:-1:2] + dtype(N)
+    strips[:, -1] = RESTART_INDEX[dtype]
+    return strips.ravel()
+
+
+# -------------- quadtree level of detail ------------------------------------
+def tile_index(k, steps=(1, 1, 1, 1)):
+    """uint16 triangle list of a (k+1) x (k+1) vertex tile whose borders are
+    stitched to coarser neighbours. steps gives, for the x min, x max, z min
+    and z max borders, the ratio of the neighbour tile size to ours: border
+    vertices snap to every steps-th vertex, where the neighbour has its own,
+    so both tiles share the exact same border and no crack opens between"""
+    N = k + 1
+    remap = np.arange(N * N, dtype=np.uint16).reshape(N, N)
+    border = np.arange(N)
+    borders = (remap[:, 0], remap[:, k], remap[0, :], remap[k, :])  # views
+    for vertices, step in zip(borders, steps):
+        if step > 1:
+            vertices[:] = vertices[np.minimum(border // step * step, k)]
+    triangles = remap.ravel()[grid_index(N)[0]].reshape(-1, 3)
+
+    # snapping collapses some triangles to a segment, drop them
+    a, b, c = triangles.T
+    return triangles[(a != b) & (b != c) & (c != a)].ravel()
+
+
+def select_tiles(camera, size, max_depth=8, detail=2.0):
+    """Leaf tiles of a quadtree over the square of given size centered on the
+    origin of the y=0 plane. A tile is split in 4 while the camera is closer
+    to it than detail times its size. Returns (x, z, tile_size, steps) for
+    each leaf, x, z being its min corner and steps its tile_index borders"""
+    leaves = set()
+
+    def visit(depth, i, j):
+        tile_size = size / 2**depth
+        x, z = -size / 2 + i * tile_size, -size / 2 + j * tile_size
+        dx = max(abs(camera[0] - x - tile_size / 2) - tile_size / 2, 0)
+        dz = max(abs(camera[2] - z - tile_size / 2) - tile_size / 2, 0)
+        distance = np.sqrt(dx * dx + camera[1] * camera[1] + dz * dz)
+        if depth < max_depth and distance < detail * tile_size:
+            for di, dj in ((0, 0), (1, 0), (0, 1), (1, 1)):
+                visit(depth + 1, 2 * i + di, 2 * j + dj)
+        else:
+            leaves.add((depth, i, j))
+
+    def neighbour_step(depth, i, j):
+        """size ratio of the leaf holding tile (i, j) if coarser, else 1"""
+        if not 0 <= i < 2**depth or not 0 <= j < 2**depth:
+            return 1
+        for level in range(depth, -1, -1):
+            shift = depth - level
+            if (level, i >> shift, j >> shift) in leaves:
+                return 1 << shift
+        return 1  # neighbour is finer, it stitches itself to us
+
+    visit(0, 0, 0)
+    tiles = []
+    for depth, i, j in sorted(leaves):
+        tile_size = size / 2**depth
+        steps = tuple(
+            neighbour_step(depth, i + di, j + dj)
+            for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1))
+        )
+        tiles.append(
+            (-size / 2 + i * tile_size, -size / 2 + j * tile_size, tile_size, steps)
+        )
+    return tiles
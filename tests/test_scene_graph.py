@@ -0,0 +1,94 @@
+"""Scene graph culling and world transform caching, without drawing: leaves
+are plain boxes recording the model matrix they are drawn with"""
+
+import numpy as np
+import pytest
+
+core = pytest.importorskip("core")  # needs OpenGL and assimpcy
+from transform import identity, translate, perspective, lookat, vec  # noqa: E402
+
+FRUSTUM = core.ViewFrustum(
+    perspective(45, 1, 1, 100) @ lookat(vec(0, 0, 10), vec(0, 0, 0), vec(0, 1, 0))
+)
+FAR = translate(1000, 0, 0)  # out of FRUSTUM
+
+
+class Box:
+    """unit box drawable, counting its draws"""
+
+    bounds = (np.full(3, -1, np.float32), np.ones(3, np.float32))
+
+    def __init__(self):
+        self.models = []
+
+    def draw(self, model=identity(), **uniforms):
+        self.models.append(np.array(model))
+
+
+class Moving(core.Node):
+    animated = True
+
+
+def draw(root):
+    root.draw(model=identity(), frustum=FRUSTUM)
+
+
+def test_animated_grandchild_moving_into_view():
+    box = Box()
+    moving = Moving([box], FAR)
+    root = core.Node([core.Node([moving])])
+    draw(root)
+    assert not box.models
+    moving.transform = identity()
+    draw(root)
+    assert len(box.models) == 1
+
+
+def test_plain_child_transform_assigned():
+    box = Box()
+    child = core.Node([box], FAR)
+    root = core.Node([core.Node([child])])
+    draw(root)
+    assert not box.models
+    child.transform = identity()
+    draw(root)
+    assert len(box.models) == 1
+    child.transform = FAR
+    draw(root)
+    assert len(box.models) == 1
+
+
+def test_static_node_shared_by_two_parents():
+    box = Box()
+    shared = core.Node([box])
+    left, right = core.Node([shared], translate(-2, 0, 0)), core.Node([shared])
+    root = core.Node([left, right])
+    root.set_static()
+    for _ in range(2):  # computed, then from the matrices kept per parent
+        box.models.clear()
+        draw(root)
+        assert [model[0, 3] for model in box.models] == [-2, 0]
+
+
+def test_compiled_scene_moves_every_occurrence_of_a_shared_node():
+    box = Box()
+    shared = core.Node([box])
+    scene = core.CompiledScene(
+        core.Node([shared], translate(-2, 0, 0)), core.Node([shared])
+    )
+    shared.transform = translate(0, 1, 0)
+    scene.draw(model=identity(), frustum=FRUSTUM)
+    assert [tuple(model[:2, 3]) for model in box.models] == [(-2, 1), (0, 1)]
+    assert scene.world_transforms(shared)[:, 1, 3].tolist() == [1, 1]
+
+
+def test_populated_placeholder_is_cached_and_static():
+    placeholder = core.Placeholder()
+    root = core.Node([placeholder])
+    root.set_static()
+    draw(root)
+    content = core.Node([Box()])
+    placeholder.add(content)
+    assert not placeholder.animated and content.static
+    draw(root)
+    assert not root._animated_children
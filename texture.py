@@ -1,8 +1,74 @@
+import multiprocessing  # image decoding processes
+import threading  # load_image is called by AsyncLoader threads
+from concurrent.futures import ProcessPoolExecutor
+
 import OpenGL.GL as GL  # standard Python OpenGL wrapper
+import numpy as np  # decoded images as arrays
 from PIL import Image  # load texture maps
 
+from cache import file_hash, load_texture, save_texture
+
+MIPMAP_FILTERS = {
+    GL.GL_NEAREST_MIPMAP_NEAREST,
+    GL.GL_NEAREST_MIPMAP_LINEAR,
+    GL.GL_LINEAR_MIPMAP_NEAREST,
+    GL.GL_LINEAR_MIPMAP_LINEAR,
+}
+
+
+# -------------- decoded image cache ------------------------------------------
+def decode_image(tex_file, mipmaps=True):
+    """RGBA mip levels of an image file, as (height, width, 4) uint8 arrays,
+    full size first then halved down to 1x1 with a box filter if mipmaps"""
+    return mip_chain(Image.open(tex_file).convert("RGBA"), mipmaps)
+
+
+def mip_chain(image, mipmaps=True):
+    """mip levels of a PIL image, see decode_image"""
+    levels = [np.asarray(image)]
+    while mipmaps and max(image.size) > 1:
+        size = (max(image.width // 2, 1), max(image.height // 2, 1))
+        image = image.resize(size, Image.BOX)
+        levels.append(np.asarray(image))
+    return levels
+
+
+def _decode_to_cache(tex_file, mipmaps, key):
+    """decode image into the cache, in a worker process. Only returns the
+    levels, to be sent back, if they could not be cached"""
+    levels = decode_image(tex_file, mipmaps)
+    try:
+        save_texture(key, levels)
+    except OSError:
+        return levels
+    return None
+
+
+_decoders = None  # process pool, started on the first cache miss
+_decoders_lock = threading.Lock()
+
+
+def load_image(tex_file, mipmaps=True):
+    """decode_image result from the texture cache, memory-mapped. On a miss,
+    the image is decoded and cached by a worker process, so that concurrent
+    misses, e.g. from AsyncLoader threads, are decoded in parallel"""
+    global _decoders
+    key = file_hash(tex_file, "rgba", mipmaps)
+    levels = load_texture(key)
+    if levels is None:
+        with _decoders_lock:  # a single pool for concurrent first misses
+            if _decoders is None:  # spawn, not to fork the GL context & threads
+                _decoders = ProcessPoolExecutor(
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+        levels = _decoders.submit(_decode_to_cache, tex_file, mipmaps, key).result()
+        levels = levels or load_texture(key)
+    return levels
+
 
 # -------------- OpenGL Texture Wrapper ---------------------------------------
+
+
 class Texture:
     """Helper class to create and automatically destroy textures"""
 
@@ -13,31 +79,35 @@ class Texture:
         mag_filter=GL.GL_LINEAR,
         min_filter=GL.GL_LINEAR_MIPMAP_LINEAR,
         tex_type=GL.GL_TEXTURE_2D,
+        image=None,
     ):
+        """image optionally gives tex_file already decoded by load_image, with
+        mip levels if min_filter uses them; mip levels are never generated"""
         self.glid = GL.glGenTextures(1)
         self.type = tex_type
         try:
-            # imports image as a numpy array in exactly right format
-            tex = Image.open(tex_file).convert("RGBA")
+            levels = image or load_image(tex_file, min_filter in MIPMAP_FILTERS)
+            height, width = levels[0].shape[:2]
             GL.glBindTexture(tex_type, self.glid)
-            GL.glTexImage2D(
-                tex_type,
-                0,
-                GL.GL_RGBA,
-                tex.width,
-                tex.height,
-                0,
-                GL.GL_RGBA,
-                GL.GL_UNSIGNED_BYTE,
-                tex.tobytes(),
-            )
+            for level, pixels in enumerate(levels):
+                GL.glTexImage2D(
+                    tex_type,
+                    level,
+                    GL.GL_RGBA,
+                    pixels.shape[1],
+                    pixels.shape[0],
+                    0,
+                    GL.GL_RGBA,
+                    GL.GL_UNSIGNED_BYTE,
+                    np.ascontiguousarray(pixels),
+                )
+            GL.glTexParameteri(tex_type, GL.GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
             GL.glTexParameteri(tex_type, GL.GL_TEXTURE_WRAP_S, wrap_mode)
             GL.glTexParameteri(tex_type, GL.GL_TEXTURE_WRAP_T, wrap_mode)
             GL.glTexParameteri(tex_type, GL.GL_TEXTURE_MIN_FILTER, min_filter)
             GL.glTexParameteri(tex_type, GL.GL_TEXTURE_MAG_FILTER, mag_filter)
-            GL.glGenerateMipmap(tex_type)
             print(
-                f"Loaded texture {tex_file} ({tex.width}x{tex.height}"
+                f"Loaded texture {tex_file} ({width}x{height}"
                 f" wrap={str(wrap_mode).split()[0]}"
                 f" min={str(min_filter).split()[0]}"
                 f" mag={str(mag_filter).split()[0]})"
@@ -49,6 +119,86 @@ class Texture:
         GL.glDeleteTextures(self.glid)
 
 
+class TextureArray:
+    """Images as the layers of one GL_TEXTURE_2D_ARRAY texture, so that meshes
+    using different images are drawn with the same texture bound, the layer
+    being selected in the shader. Layers share one size: the smallest of the
+    images, capped by max_size. Larger images are downscaled to it, never the
+    reverse, so the array takes at most the memory of separate textures, but
+    mixing sizes loses detail: see size_groups to build one array per size"""
+
+    def __init__(
+        self,
+        tex_files,
+        wrap_mode=GL.GL_REPEAT,
+        mag_filter=GL.GL_LINEAR,
+        min_filter=GL.GL_LINEAR_MIPMAP_LINEAR,
+        max_size=1024,
+        images=None,
+    ):
+        """images optionally maps some tex_files to their load_image levels"""
+        self.glid = GL.glGenTextures(1)
+        self.type = GL.GL_TEXTURE_2D_ARRAY
+        mipmaps = min_filter in MIPMAP_FILTERS
+        layers = [self._levels(tex_file, images) for tex_file in tex_files]
+        width = min(min(levels[0].shape[1] for levels in layers), max_size)
+        height = min(min(levels[0].shape[0] for levels in layers), max_size)
+
+        # bring all layers to the same size and number of mip levels
+        for index, levels in enumerate(layers):
+            if levels[0].shape[:2] != (height, width):
+                image = Image.fromarray(np.asarray(levels[0]))
+                levels = mip_chain(image.resize((width, height), Image.BOX))
+            layers[index] = levels if mipmaps else levels[:1]
+
+        GL.glBindTexture(self.type, self.glid)
+        for level in range(len(layers[0])):
+            pixels = np.stack([levels[level] for levels in layers])
+            GL.glTexImage3D(
+                self.type,
+                level,
+                GL.GL_RGBA8,
+                pixels.shape[2],
+                pixels.shape[1],
+                len(layers),
+                0,
+                GL.GL_RGBA,
+                GL.GL_UNSIGNED_BYTE,
+                pixels,
+            )
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_MAX_LEVEL, len(layers[0]) - 1)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_S, wrap_mode)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_WRAP_T, wrap_mode)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_MIN_FILTER, min_filter)
+        GL.glTexParameteri(self.type, GL.GL_TEXTURE_MAG_FILTER, mag_filter)
+        print(f"Loaded texture array of {len(layers)} {width}x{height} layers")
+
+    @staticmethod
+    def _levels(tex_file, images=None):
+        """mip levels of tex_file, from images or load_image, or a 1x1 black
+        image if it cannot be loaded"""
+        try:
+            return (images or {}).get(tex_file) or load_image(tex_file)
+        except FileNotFoundError:
+            print("ERROR: unable to load texture file %s" % tex_file)
+            return [np.zeros((1, 1, 4), np.uint8)]
+
+    @staticmethod
+    def size_groups(tex_files, images=None, max_size=1024):
+        """tex_files grouped by image size, capped by max_size, in order of
+        first appearance: the layers of one TextureArray per group keep their
+        full resolution, with one texture to bind per distinct size"""
+        groups = {}
+        for tex_file in tex_files:
+            height, width = TextureArray._levels(tex_file, images)[0].shape[:2]
+            size = (min(width, max_size), min(height, max_size))
+            groups.setdefault(size, []).append(tex_file)
+        return list(groups.values())
+
+    def __del__(self):  # delete GL texture from GPU when object dies
+        GL.glDeleteTextures(self.glid)
+
+
 # -------------- Textured mesh decorator --------------------------------------
 class Textured:
     """Drawable mesh decorator that activates and binds OpenGL textures"""
@@ -57,9 +207,22 @@ class Textured:
         self.drawable = drawable
         self.textures = textures
 
+    @property
+    def bounds(self):
+        """bounding box of the decorated drawable, if it has one"""
+        return getattr(self.drawable, "bounds", None)
+
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
+        # with a draw queue, textures are bound when the queue is flushed
+        queue = uniforms.get("queue")
+        textures = list(uniforms.get("textures", ()))
         for index, (name, texture) in enumerate(self.textures.items()):
-            GL.glActiveTexture(GL.GL_TEXTURE0 + index)
-            GL.glBindTexture(texture.type, texture.glid)
+            if queue is None:
+                GL.glActiveTexture(GL.GL_TEXTURE0 + index)
+                GL.glBindTexture(texture.type, texture.glid)
+            else:
+                textures.append((index, texture))
             uniforms[name] = index
+        if queue is not None:
+            uniforms["textures"] = tuple(textures)
         self.drawable.draw(primitives=primitives, **uniforms)
@@ -24,6 +24,23 @@ def normalized(vector):
     return vector / norm if norm > 0. else vector
 
 
+# single small vectors are unpacked to Python floats: numpy per-call overhead
+# dominates on 3 or 4 components, batched versions below handle arrays of them
+def _unit(vector):
+    """ components of vector as a list of floats, normalized if not null """
+    vector = vector.tolist() if isinstance(vector, np.ndarray) \
+        else [float(c) for c in vector]
+    norm = math.sqrt(sum(c*c for c in vector))
+    return [c / norm for c in vector] if norm > 0. else vector
+
+
+def _dtype(*vectors):
+    """ dtype numpy gives to results computed from vectors: that of arrays,
+        float64 for sequences of Python numbers """
+    return np.result_type(*(v.dtype if isinstance(v, np.ndarray) else 'd'
+                            for v in vectors))
+
+
 def lerp(point_a, point_b, fraction):
     """ linear interpolation between two quantities with linear operators """
     return point_a + fraction * (point_b - point_a)
@@ -93,7 +110,7 @@ def sincos(degrees=0.0, radians=None):
 
 def rotate(axis=(1., 0., 0.), angle=0.0, radians=None):
     """ 4x4 rotation matrix around 'axis' with 'angle' degrees or 'radians' """
-    x, y, z = normalized(vec(axis))
+    x, y, z = _unit(axis)
     s, c = sincos(angle, radians)
     nc = 1 - c
     return np.array([[x*x*nc + c,   x*y*nc - z*s, x*z*nc + y*s, 0],
@@ -138,15 +155,17 @@ def quaternion_from_euler(yaw=0.0, pitch=0.0, roll=0.0, radians=None):
 
 def quaternion_mul(q1, q2):
     """ Compute quaternion which composes rotations of two quaternions """
-    return np.dot(np.array([[q1[0], -q1[1], -q1[2], -q1[3]],
-                            [q1[1],  q1[0], -q1[3],  q1[2]],
-                            [q1[2],  q1[3],  q1[0], -q1[1]],
-                            [q1[3], -q1[2],  q1[1],  q1[0]]]), q2)
+    w1, x1, y1, z1 = q1.tolist() if isinstance(q1, np.ndarray) else q1
+    w2, x2, y2, z2 = q2.tolist() if isinstance(q2, np.ndarray) else q2
+    return np.array((w1*w2 - x1*x2 - y1*y2 - z1*z2,
+                     x1*w2 + w1*x2 - z1*y2 + y1*z2,
+                     y1*w2 + z1*x2 + w1*y2 - x1*z2,
+                     z1*w2 - y1*x2 + x1*y2 + w1*z2), _dtype(q1, q2))
 
 
 def quaternion_matrix(q):
     """ Create 4x4 rotation matrix from quaternion q """
-    q = normalized(q)  # only unit quaternions are valid rotations.
+    q = _unit(q)  # only unit quaternions are valid rotations.
     nxx, nyy, nzz = -q[1]*q[1], -q[2]*q[2], -q[3]*q[3]
     qwx, qwy, qwz = q[0]*q[1], q[0]*q[2], q[0]*q[3]
     qxy, qxz, qyz = q[1]*q[2], q[1]*q[3], q[2]*q[3]
@@ -159,18 +178,134 @@ def quaternion_matrix(q):
 def quaternion_slerp(q0, q1, fraction):
     """ Spherical interpolation of two quaternions by 'fraction' """
     # only unit quaternions are valid rotations.
-    q0, q1 = normalized(q0), normalized(q1)
-    dot = np.dot(q0, q1)
+    dtype = _dtype(q0, q1)
+    q0, q1 = _unit(q0), _unit(q1)
+    dot = sum(c0*c1 for c0, c1 in zip(q0, q1))
 
     # if negative dot product, the quaternions have opposite handedness
     # and slerp won't take the shorter path. Fix by reversing one quaternion.
-    q1, dot = (q1, dot) if dot > 0 else (-q1, -dot)
+    q1, dot = (q1, dot) if dot > 0 else ([-c for c in q1], -dot)
+
+    theta_0 = math.acos(min(max(dot, -1), 1))  # angle between input vectors
+    theta = theta_0 * fraction                 # angle between q0 and result
+    q2 = _unit([c1 - c0*dot for c0, c1 in zip(q0, q1)])  # {q0, q2} orthonormal
+
+    cos, sin = math.cos(theta), math.sin(theta)
+    return np.array([c0*cos + c2*sin for c0, c2 in zip(q0, q2)], dtype)
+
+
+# batched versions, on (..., 4) quaternions and (..., 4, 4) matrices ----------
+# results are float32, written to the optional out array of the right shape
+def normalized_rows(vectors):
+    """ vectors of the last axis normalized, zero vectors left unchanged """
+    norm = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norm > 0, norm, 1)
 
-    theta_0 = math.acos(np.clip(dot, -1, 1))  # angle between input vectors
-    theta = theta_0 * fraction                # angle between q0 and result
-    q2 = normalized(q1 - q0*dot)              # {q0, q2} now orthonormal basis
 
-    return q0*math.cos(theta) + q2*math.sin(theta)
+def _matrices(shape, out):
+    """ (shape, 4, 4) float32 array to fill, out if given """
+    return np.empty(shape + (4, 4), 'f') if out is None else out
+
+
+def translations(vectors, out=None):
+    """ (..., 4, 4) translate matrices of (..., 3) vectors """
+    vectors = np.asarray(vectors, 'f')
+    matrices = _matrices(vectors.shape[:-1], out)
+    matrices[...] = np.identity(4, 'f')
+    matrices[..., :3, 3] = vectors
+    return matrices
+
+
+def scalings(factors, out=None):
+    """ (..., 4, 4) scale matrices of (..., 3) or uniform (..., 1) factors """
+    factors = np.asarray(factors, 'f')
+    matrices = _matrices(factors.shape[:-1], out)
+    matrices[...] = 0
+    for axis in range(3):
+        matrices[..., axis, axis] = factors[..., min(axis, factors.shape[-1]-1)]
+    matrices[..., 3, 3] = 1
+    return matrices
+
+
+def rotations(axes, angles=0.0, radians=None, out=None):
+    """ (..., 4, 4) rotate matrices of (..., 3) axes, by (...) angles in
+        degrees or radians """
+    x, y, z = np.moveaxis(normalized_rows(np.asarray(axes, 'f')), -1, 0)
+    radians = np.radians(angles) if radians is None else np.asarray(radians)
+    s, c = np.sin(radians, dtype='f'), np.cos(radians, dtype='f')
+    nc = 1 - c
+    matrices = _matrices(np.broadcast(x, s).shape, out)
+    matrices[..., 0, :] = np.stack(np.broadcast_arrays(
+        x*x*nc + c, x*y*nc - z*s, x*z*nc + y*s, 0), -1)
+    matrices[..., 1, :] = np.stack(np.broadcast_arrays(
+        y*x*nc + z*s, y*y*nc + c, y*z*nc - x*s, 0), -1)
+    matrices[..., 2, :] = np.stack(np.broadcast_arrays(
+        x*z*nc - y*s, y*z*nc + x*s, z*z*nc + c, 0), -1)
+    matrices[..., 3, :] = (0, 0, 0, 1)
+    return matrices
+
+
+def lookats(eyes, targets, ups, out=None):
+    """ (..., 4, 4) lookat view matrices of (..., 3) eyes, targets, ups """
+    eyes = np.asarray(eyes, 'f')
+    view = normalized_rows(np.asarray(targets, 'f') - eyes)
+    right = np.cross(view, normalized_rows(np.asarray(ups, 'f')))
+    up = np.cross(right, view)
+    matrices = _matrices(np.broadcast_shapes(view.shape, up.shape)[:-1], out)
+    matrices[..., 0, :3], matrices[..., 1, :3] = right, up
+    matrices[..., 2, :3] = -view
+    matrices[..., 3, :] = (0, 0, 0, 1)
+    matrices[..., :3, 3] = -np.einsum('...ij,...j->...i',
+                                      matrices[..., :3, :3], eyes)
+    return matrices
+
+
+def quaternion_muls(q1, q2, out=None):
+    """ (..., 4) quaternions composing rotations of (..., 4) q1 and q2 """
+    w1, x1, y1, z1 = np.moveaxis(np.asarray(q1, 'f'), -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(np.asarray(q2, 'f'), -1, 0)
+    product = np.empty(np.broadcast(w1, w2).shape + (4,), 'f') \
+        if out is None else out
+    product[..., 0] = w1*w2 - x1*x2 - y1*y2 - z1*z2
+    product[..., 1] = x1*w2 + w1*x2 - z1*y2 + y1*z2
+    product[..., 2] = y1*w2 + z1*x2 + w1*y2 - x1*z2
+    product[..., 3] = z1*w2 - y1*x2 + x1*y2 + w1*z2
+    return product
+
+
+def quaternion_matrices(q, out=None):
+    """ (..., 4, 4) rotation matrices of (..., 4) quaternions """
+    w, x, y, z = np.moveaxis(normalized_rows(np.asarray(q, 'f')), -1, 0)
+    matrices = _matrices(w.shape, out)
+    matrices[..., 0, :3] = np.stack((1 - 2*(y*y + z*z), 2*(x*y - w*z),
+                                     2*(x*z + w*y)), -1)
+    matrices[..., 1, :3] = np.stack((2*(x*y + w*z), 1 - 2*(x*x + z*z),
+                                     2*(y*z - w*x)), -1)
+    matrices[..., 2, :3] = np.stack((2*(x*z - w*y), 2*(y*z + w*x),
+                                     1 - 2*(x*x + y*y)), -1)
+    matrices[..., :3, 3] = 0
+    matrices[..., 3, :] = (0, 0, 0, 1)
+    return matrices
+
+
+def quaternion_slerps(q0, q1, fraction, out=None):
+    """ quaternion_slerp of (..., 4) quaternion pairs by (...) fractions """
+    q0, q1 = normalized_rows(np.asarray(q0, 'f')), normalized_rows(q1)
+    dot = np.sum(q0 * q1, axis=-1, keepdims=True)
+    q1 = np.where(dot > 0, q1, -q1)   # shorter path, see quaternion_slerp
+    dot = np.abs(dot)
+    theta = np.arccos(np.clip(dot, -1, 1)) * np.asarray(fraction)[..., None]
+    q2 = normalized_rows(q1 - q0*dot)
+    return np.add(q0*np.cos(theta), q2*np.sin(theta), out=out)
+
+
+def trs_matrices(translation, rotation, scaling, out=None):
+    """ (..., 4, 4) matrices translate @ rotate @ scale of (..., 3)
+        translations, (..., 4) quaternions and (..., 3) or (..., 1) scales """
+    matrices = quaternion_matrices(rotation, out)
+    matrices[..., :3, :3] *= np.asarray(scaling, 'f')[..., None, :]
+    matrices[..., :3, 3] = translation
+    return matrices
 
 
 # a trackball class based on provided quaternion functions -------------------
@@ -0,0 +1,23 @@
+#version 330 core
+
+uniform mat4 model;
+layout (std140) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
+in vec3 position;
+in vec3 normal;
+
+out vec2 frag_tex_coords;
+out vec3 w_normal;
+out vec3 w_position;
+
+// heights and normals are baked on the CPU, see terrain.py
+void main() {
+    w_normal = (model * vec4(normal, 0)).xyz;
+    w_position = (model * vec4(position, 1)).xyz;
+
+    gl_Position = projection * view * model * vec4(position, 1);
+    frag_tex_coords = position.xz * 0.1;
+}
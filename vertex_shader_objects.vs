@@ -1,20 +1,28 @@
 #version 330 core
 
 uniform mat4 model;
-uniform mat4 view;
-uniform mat4 projection;
+uniform mat4 dequantize = mat4(1);  // compact positions, see VertexArray
+layout (std140) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
 in vec3 position;
 in vec3 normal;
 in vec2 tex_coord;
+in float layer;  // texture array layer, see fragment_shader_array.fs
 
 out vec3 w_normal;
 out vec3 w_position;
 out vec2 frag_tex_coords;
+flat out float frag_layer;
 
 void main() {
+    vec4 mesh_position = dequantize * vec4(position, 1);
     w_normal = (model * vec4(normal, 0)).xyz;
-    w_position = (model * vec4(position, 1)).xyz;
+    w_position = (model * mesh_position).xyz;
 
-    gl_Position = projection * view * model * vec4(position, 1);
+    gl_Position = projection * view * model * mesh_position;
     frag_tex_coords = tex_coord;
+    frag_layer = layer;
 }
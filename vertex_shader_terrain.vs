@@ -0,0 +1,63 @@
+#version 330 core
+
+uniform mat4 model;
+layout (std140) uniform Camera {
+    mat4 view;
+    mat4 projection;
+    vec3 w_camera_position;
+};
+uniform vec2 tile_origin;
+uniform float tile_size;
+in vec3 position;
+
+out vec2 frag_tex_coords;
+out vec3 w_normal;
+out vec3 w_position;
+
+float hash31(in vec3 p){
+  return fract(sin(dot(p,vec3(12.9898,78.233,45.5432)))*43758.5453123);
+}
+
+// vNoise of vertex_shader_desert.vs on the y=0 plane, with its analytic
+// derivatives along x and z: returns (value, d/dx, d/dz)
+vec3 vNoised(in vec2 p){
+  vec3 c = floor(vec3(p.x, 0, p.y));
+  vec2 f = fract(p);
+  vec2 u = f * f * (3 - 2*f);
+  vec2 du = 6 * f * (1 - f);
+  float v1 = hash31(c);
+  float v2 = hash31(c + vec3(1,0,0));
+  float v5 = hash31(c + vec3(0,0,1));
+  float v6 = hash31(c + vec3(1,0,1));
+  float m1x = mix(v1, v2, u.x);
+  float m3x = mix(v5, v6, u.x);
+  return vec3(mix(m1x, m3x, u.y),
+              du.x * mix(v2 - v1, v6 - v5, u.y),
+              du.y * (m3x - m1x));
+}
+
+vec3 fNoised(in vec2 p, in float amp, in float freq, in float pers, in int nbOct) {
+  float f = freq;
+  float a = amp;
+  vec3 n = vec3(0);
+  for (int i = 0; i < nbOct; i++){
+    n += vNoised(p * f) * vec3(a, a * f, a * f);
+    f = f * 2;
+    a = a * pers;
+  }
+  return n;
+}
+
+void main() {
+    // unit tile coordinates to desert coordinates
+    vec3 pos = vec3(tile_origin.x + position.x * tile_size, 0,
+                    tile_origin.y + position.z * tile_size);
+    vec3 noise = fNoised(pos.xz, 20, 0.02, 0.1, 15);
+    pos.y = noise.x;
+    vec3 normal = normalize(vec3(-noise.y, 1, -noise.z));
+    w_normal = (model * vec4(normal, 0)).xyz;
+    w_position = (model * vec4(pos, 1)).xyz;
+
+    gl_Position = projection * view * model * vec4(pos, 1);
+    frag_tex_coords = pos.xz * 0.1;
+}
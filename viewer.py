@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
 import sys
+import argparse
+import contextlib
+import json
 from itertools import cycle
 import OpenGL.GL as GL  # standard Python OpenGL wrapper
 import glfw  # lean window system wrapper for OpenGL
 import numpy as np  # all matrix manipulations & OpenGL args
-from core import Shader, Viewer, Mesh, load, Node
+from core import Shader, Viewer, Mesh, VertexArray, load, Node, aabb_transform
+from core import UniformBlock, AsyncLoader, CompiledScene
 from texture import Texture, Textured
+from profiling import Profiler
 import random as rng
-from animation import KeyFrameLoopControlNode, TransformKeyFrames
-from transform import scale, rotate, translate, quaternion, quaternion_from_euler
+from animation import KeyFrameLoopControlNode, TransformKeyFrames, baked_nbytes
+from transform import (
+    scale,
+    rotate,
+    translate,
+    identity,
+    quaternion,
+    quaternion_from_euler,
+)
+from terrain import heightfield, grid_positions, grid_index, tile_index, select_tiles
+from terrain import MAX_HEIGHT
 
 
 class Skybox(Node):
@@ -93,15 +107,12 @@ class Skybox(Node):
 class Desert(Textured):
     """Class for drawing a desert object"""
 
-    def __init__(self, shader, light, N=750, size=1800.0):
-        # prepare texture modes and light
-        self.light_dir = light[0]
-        self.light_ambiant = light[1]
-        self.light_diffuse = light[2]
-        self.light_specular = light[3]
-
+    def __init__(self, shader, N=750, size=1800.0, baked=False, index_mode="strip16"):
+        """baked desert heights are computed once on the CPU, and need the
+        vertex_shader_desert_baked.vs shader instead of vertex_shader_desert.vs
+        """
         # setup plane mesh to be textured
-        mesh = Grid(shader, N, size)
+        mesh = Grid(shader, N, size, baked, index_mode)
 
         texture = Texture(
             "./Models/Texture/sable.jpg",
@@ -110,69 +121,111 @@ class Desert(Textured):
         )
         super().__init__(mesh, diffuse_map=texture)
 
-    def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
-        super().draw(
-            primitives=primitives,
-            light_dir=self.light_dir,
-            light_ambiant=self.light_ambiant,
-            light_diffuse=self.light_diffuse,
-            light_specular=self.light_specular,
-            **uniforms,
+
+class ChunkedDesert(Node):
+    """Desert split in tiles by a quadtree, tiles getting coarser with the
+    camera distance so that vertex cost follows screen detail, not area.
+    Heights are computed by vertex_shader_terrain.vs from tile uniforms"""
+
+    def __init__(self, shader, size=1800.0, resolution=32, max_depth=8, detail=2.0):
+        super().__init__()
+        self.shader = shader
+        self.size, self.resolution = size, resolution
+        self.max_depth, self.detail = max_depth, detail
+        self.texture = Texture(
+            "./Models/Texture/sable.jpg",
+            GL.GL_REPEAT,
+            *(GL.GL_LINEAR, GL.GL_LINEAR_MIPMAP_LINEAR),
         )
 
+        # all tiles share a unit square grid, scaled by tile uniforms
+        self.position = grid_positions(resolution + 1, 1.0) + (0.5, 0, 0.5)
+        self.tile_meshes = {}  # border steps -> stitched tile mesh
+        self.camera, self.tiles = None, []
+
+    def tile_mesh(self, steps):
+        """tile mesh stitched to coarser neighbours, created on first use"""
+        mesh = self.tile_meshes.get(steps)
+        if mesh is None:
+            index = tile_index(self.resolution, steps)
+            mesh = Mesh(self.shader, dict(position=self.position), index=index)
+            mesh.bounds = None  # unit tile positions, culled per tile in draw
+            mesh = Textured(mesh, diffuse_map=self.texture)
+            self.tile_meshes[steps] = mesh
+        return mesh
+
+    @property
+    def content_bounds(self):
+        half = self.size / 2
+        return np.array((-half, 0, -half)), np.array((half, MAX_HEIGHT, half))
+
+    def draw(self, primitives=GL.GL_TRIANGLES, model=identity(), **uniforms):
+        self.update_world(model)
+        frustum = uniforms.get("frustum")
+
+        # camera in desert coordinates, tiles only change when it moves
+        camera = self.world_inverse @ uniforms["w_camera_position"]
+        if self.camera is None or not np.allclose(camera, self.camera):
+            self.camera = camera
+            self.tiles = select_tiles(camera, self.size, self.max_depth, self.detail)
+
+        for x, z, tile_size, steps in self.tiles:
+            if frustum is not None:
+                low = np.array((x, 0, z))
+                high = low + (tile_size, MAX_HEIGHT, tile_size)
+                box = aabb_transform(self.world_transform, (low, high))
+                if not frustum.intersects(box):
+                    continue
+            self.tile_mesh(steps).draw(
+                primitives=primitives,
+                model=self.world_transform,
+                tile_origin=(x, z),
+                tile_size=tile_size,
+                **uniforms,
+            )
+
 
 class Grid(Mesh):
     """Class for desert mesh construction"""
 
-    def __init__(self, shader, N, size):
+    def __init__(self, shader, N, size, baked=False, index_mode="triangles"):
+        """index_mode is one of terrain.grid_index modes, strips use less
+        index memory than the triangle list: "strip16" needs 2 bytes per
+        vertex instead of 24 bytes per cell, for one band of rows only"""
         self.shader = shader
 
-        # positions
-        x_position = np.zeros((N, N))
-        z_position = np.zeros((N, N))
-        # init x_position and y_position
-        for j in range(N):
-            for i in range(N):
-                x_position[j][i] = -size / 2 + i * size / (N - 1)
-                z_position[j][i] = -size / 2 + j * size / (N - 1)
-
-        x_position = x_position.flatten()
-        z_position = z_position.flatten()
-        y_position = np.zeros((N, N)).flatten()
+        # positions, in a row major N x N grid
+        position = grid_positions(N, size)
+        attributes = dict(position=position)
 
-        position = np.vstack((x_position, y_position, z_position)).T
+        # optionally bake noise heights and normals instead of shader noise
+        if baked:
+            height, normal = heightfield(position[:, 0], position[:, 2])
+            position[:, 1] = height
+            attributes.update(normal=normal)
 
         # indexes
-        mat = np.reshape(np.arange(N * N), (N, N))
-
-        top = np.vstack(
-            (
-                mat[:-1, :-1].flatten(),
-                mat[1:, :-1].flatten(),
-                mat[:-1, 1:].flatten(),
-            )
-        ).T.flatten()
-
-        bottom = np.vstack(
-            (
-                mat[1:, :-1].flatten(),
-                mat[1:, 1:].flatten(),
-                mat[:-1, 1:].flatten(),
-            )
-        ).T.flatten()
-
-        index = np.hstack((top, bottom))
+        index, ranges = grid_index(N, index_mode)
+        strips = index_mode != "triangles"
+        self.primitives = GL.GL_TRIANGLE_STRIP if strips else GL.GL_TRIANGLES
+        vertex_array = VertexArray(
+            shader, attributes, index, restart=strips, ranges=ranges
+        )
 
-        attributes = dict(position=position)
+        super().__init__(shader, attributes, index=index, vertex_array=vertex_array)
 
-        super().__init__(shader, attributes=attributes, index=index)
+        # dynamic heights are only known by the shader, bound them by the noise
+        if not baked:
+            self.bounds = (self.bounds[0], self.bounds[1] + (0, MAX_HEIGHT, 0))
 
     def draw(self, primitives=GL.GL_TRIANGLES, **uniforms):
-        super().draw(primitives=primitives, global_color=(0, 0, 0), **uniforms)
+        super().draw(primitives=self.primitives, global_color=(0, 0, 0), **uniforms)
 
 
 class Castle(Node):
-    def __init__(self, shader, light):
+    def __init__(self, shader, load=load):
+        """shader samples texture arrays, e.g. with fragment_shader_array.fs:
+        the castle textures are layers of one array, bound once"""
         super().__init__()
 
         self.transform = translate(y=+10) @ scale(x=0.01, y=0.01, z=0.01)
@@ -180,52 +233,79 @@ class Castle(Node):
             *load(
                 "./Models/Castle/castle_no_floor.obj",
                 shader,
-                light_dir=light[0],
-                light_ambiant=light[1],
-                light_diffuse=light[2],
-                light_specular=light[3],
+                texture_array=True,
+                compact=True,
             )
         )
 
 
 class Cactus(Node):
-    def __init__(self, shader, light, position=(0.0, 0.0, 0.0)):
+    models = [
+        "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
+        "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
+        "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
+        "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
+        "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
+        "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
+        "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
+        "./Models/Cactus2/Models/SW01_1.obj",
+        "./Models/Cactus2/Models/SW01_2.obj",
+        "./Models/Cactus2/Models/SW01_3.obj",
+        "./Models/Cactus2/Models/SW01_4.obj",
+        "./Models/Cactus2/Models/SW01_5.obj",
+        "./Models/Cactus2/Models/SW01_6.obj",
+    ]
+
+    def __init__(self, shader, position=(0.0, 0.0, 0.0), load=load):
         super().__init__()
 
-        tex_list = [
-            "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
-            "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
-            "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
-            "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
-            "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
-            "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
-            "./Models/Cactus1/10436_Cactus_v1_max2010_it2.obj",
-            "./Models/Cactus2/Models/SW01_1.obj",
-            "./Models/Cactus2/Models/SW01_2.obj",
-            "./Models/Cactus2/Models/SW01_3.obj",
-            "./Models/Cactus2/Models/SW01_4.obj",
-            "./Models/Cactus2/Models/SW01_5.obj",
-            "./Models/Cactus2/Models/SW01_6.obj",
-        ]
-
         self.transform = (
             translate(position) @ rotate((1, 0, 0), -90.0) @ scale(0.7, 0.7, 0.7)
         )
 
-        self.add(
-            *load(
-                rng.choice(tex_list),
-                shader,
-                light_dir=light[0],
-                light_ambiant=light[1],
-                light_diffuse=light[2],
-                light_specular=light[3],
+        self.add(*load(rng.choice(self.models), shader, compact=True))
+
+
+class CactusField(Node):
+    """Cacti scattered at given positions, drawn with one instanced draw call
+    per cactus model whatever the number of cacti. Textures of each model are
+    layers of a texture array, so shader samples them as Castle does"""
+
+    def __init__(self, shader, positions, load=load):
+        super().__init__()
+
+        # pick a random model for each cactus, then group cacti by model
+        transforms = {}
+        for position in positions:
+            transform = (
+                translate(position) @ rotate((1, 0, 0), -90.0) @ scale(0.7, 0.7, 0.7)
+            )
+            transforms.setdefault(rng.choice(Cactus.models), []).append(transform)
+
+        for model, instances in transforms.items():
+            self.add(
+                *load(
+                    model,
+                    shader,
+                    instances=np.array(instances, np.float32),
+                    texture_array=True,
+                    compact=True,
+                )
             )
-        )
+
+    @staticmethod
+    def scatter(count, size=1800.0, height=15.0):
+        """random cactus positions over a square desert of given size"""
+        return [
+            (rng.uniform(-size / 2, size / 2), height, rng.uniform(-size / 2, size / 2))
+            for _ in range(count)
+        ]
 
 
 class Dragon(Node):
-    def __init__(self, shader, light):
+    bake_rate = 240  # samples per second of the baked loops, see BakedLoop
+
+    def __init__(self, shader, load=load):
         super().__init__()
 
         self.radius = 100
@@ -244,17 +324,10 @@ class Dragon(Node):
         }
         scale_keys = {0: 1}
 
-        self.body = KeyFrameLoopControlNode(translate_keys, rotate_keys, scale_keys)
-        self.body.add(
-            *load(
-                "./Models/Dragon/dargeon.obj",
-                shader,
-                light_dir=light[0],
-                light_ambiant=light[1],
-                light_diffuse=light[2],
-                light_specular=light[3],
-            )
+        self.body = KeyFrameLoopControlNode(
+            translate_keys, rotate_keys, scale_keys, bake=self.bake_rate
         )
+        self.body.add(*load("./Models/Dragon/dargeon.obj", shader, compact=True))
 
         translate_keys = {0: (5, 51, -7)}
         rotate_keys = {
@@ -265,18 +338,9 @@ class Dragon(Node):
         }
         scale_keys = {0: 1}
         self.left_wing = KeyFrameLoopControlNode(
-            translate_keys, rotate_keys, scale_keys
-        )
-        self.left_wing.add(
-            *load(
-                "./Models/Dragon/left-wing.obj",
-                shader,
-                light_dir=light[0],
-                light_ambiant=light[1],
-                light_diffuse=light[2],
-                light_specular=light[3],
-            )
+            translate_keys, rotate_keys, scale_keys, bake=self.bake_rate
         )
+        self.left_wing.add(*load("./Models/Dragon/left-wing.obj", shader, compact=True))
 
         translate_keys = {0: (-5, 51, -7)}
         rotate_keys = {
@@ -287,17 +351,10 @@ class Dragon(Node):
         }
         scale_keys = {0: 1}
         self.right_wing = KeyFrameLoopControlNode(
-            translate_keys, rotate_keys, scale_keys
+            translate_keys, rotate_keys, scale_keys, bake=self.bake_rate
         )
         self.right_wing.add(
-            *load(
-                "./Models/Dragon/right-wing.obj",
-                shader,
-                light_dir=light[0],
-                light_ambiant=light[1],
-                light_diffuse=light[2],
-                light_specular=light[3],
-            )
+            *load("./Models/Dragon/right-wing.obj", shader, compact=True)
         )
 
         self.body.add(self.left_wing)
@@ -335,57 +392,150 @@ class Dragon(Node):
 
 
 # -------------- main program and scene setup --------------------------------
-def main():
-    """create a window, add scene objects, then run rendering loop"""
-    viewer = Viewer()
-    shader_desert = Shader("vertex_shader_desert.vs", "fragment_shader.fs")
+def build_scene(viewer, desert_mode="chunked", load=load, compiled=False):
+    """add scene objects to viewer, and set its initial camera. desert_mode is
+    "dynamic": desert noise per vertex per frame, "baked": computed once on
+    CPU, "chunked": quadtree tiles with camera distance level of detail.
+    Models are loaded with load, e.g. AsyncLoader.load to load them while
+    rendering. compiled draws the scene through a CompiledScene instead of
+    recursing into its nodes. The light uniform block is kept alive as
+    viewer.light, its buffer being read by all shaders"""
+    desert_shaders = dict(
+        dynamic="vertex_shader_desert.vs",
+        baked="vertex_shader_desert_baked.vs",
+        chunked="vertex_shader_terrain.vs",
+    )
+    shader_desert = Shader(desert_shaders[desert_mode], "fragment_shader.fs")
     shader_skybox = Shader("vertex_shader_sky.vs", "fragment_shader_sky.fs")
     shader_obj = Shader("vertex_shader_objects.vs", "fragment_shader.fs")
-
-    light_dir = (0.0, 1.0, 0.0)
-    light_ambiant = (1.0, 0.94, 0.84)
-    light_diffuse = (1.0, 0.72, 0.56)
-    light_specular = (0.5, 0.5, 0.5)
-
-    light = (light_dir, light_ambiant, light_diffuse, light_specular)
-
-    viewer.add(Desert(shader_desert, light))
-    viewer.add(Castle(shader_obj, light))
-    viewer.add(Cactus(shader_obj, light, (150, 15, 400)))
-    viewer.add(Cactus(shader_obj, light, (-640, 15, 100)))
-    viewer.add(Cactus(shader_obj, light, (337, 15, -334)))
-    viewer.add(Cactus(shader_obj, light, (-64, 15, -184)))
-    viewer.add(Cactus(shader_obj, light, (-699, 15, 605)))
-    viewer.add(Cactus(shader_obj, light, (326, 15, -639)))
-    viewer.add(Cactus(shader_obj, light, (326, 15, -639)))
-    viewer.add(Cactus(shader_obj, light, (-115, 15, 522)))
-    viewer.add(Cactus(shader_obj, light, (327, 15, -257)))
-    viewer.add(Cactus(shader_obj, light, (-226, 15, 347)))
-    viewer.add(Cactus(shader_obj, light, (-321, 15, -144)))
-    viewer.add(Cactus(shader_obj, light, (-144, 15, 654)))
-    viewer.add(Cactus(shader_obj, light, (715, 15, 175)))
-    viewer.add(Cactus(shader_obj, light, (-352, 15, 542)))
-    viewer.add(Cactus(shader_obj, light, (-51, 15, -711)))
-    viewer.add(Cactus(shader_obj, light, (-399, 15, -293)))
-    viewer.add(Cactus(shader_obj, light, (258, 15, -221)))
-    viewer.add(Cactus(shader_obj, light, (211, 15, 126)))
-    viewer.add(Cactus(shader_obj, light, (348, 15, 614)))
-
-    viewer.add(Dragon(shader_obj, light))
-
-    viewer.add(Skybox(shader_skybox))
+    shader_castle = Shader("vertex_shader_objects.vs", "fragment_shader_array.fs")
+    shader_cactus = Shader(
+        "vertex_shader_objects_instanced.vs", "fragment_shader_array.fs"
+    )
+
+    # light, shared by all shader programs. light_ambient is left black: it
+    # is added unscaled to the shaded color and would wash out the scene
+    viewer.light = light = UniformBlock(
+        "Light",
+        light_dir="vec3",
+        light_ambient="vec3",
+        light_diffuse="vec3",
+        light_specular="vec3",
+    )
+    light.update(
+        light_dir=(0.0, 1.0, 0.0),
+        light_diffuse=(1.0, 0.72, 0.56),
+        light_specular=(0.5, 0.5, 0.5),
+    )
+
+    if desert_mode == "chunked":
+        desert = ChunkedDesert(shader_desert)
+    else:
+        desert = Desert(shader_desert, baked=desert_mode == "baked")
+    castle = Castle(shader_castle, load)
+    cactus_positions = [
+        (150, 15, 400),
+        (-640, 15, 100),
+        (337, 15, -334),
+        (-64, 15, -184),
+        (-699, 15, 605),
+        (326, 15, -639),
+        (326, 15, -639),
+        (-115, 15, 522),
+        (327, 15, -257),
+        (-226, 15, 347),
+        (-321, 15, -144),
+        (-144, 15, 654),
+        (715, 15, 175),
+        (-352, 15, 542),
+        (-51, 15, -711),
+        (-399, 15, -293),
+        (258, 15, -221),
+        (211, 15, 126),
+        (348, 15, 614),
+    ]
+    cacti = CactusField(shader_cactus, cactus_positions, load)
+    skybox = Skybox(shader_skybox)
+
+    # scenery never moves: world transforms and bounds are computed once
+    for node in (desert, castle, cacti, skybox):
+        if isinstance(node, Node):
+            node.set_static()
+    scene = (desert, castle, cacti, Dragon(shader_obj, load), skybox)
+    viewer.add(*((CompiledScene(*scene),) if compiled else scene))
 
     viewer.trackball.distance = 1000
     viewer.trackball.rotation = quaternion_from_euler(50, 60, 50)
 
-    viewer.run()
 
+def main():
+    """create a window, add scene objects, then run rendering loop, or with
+    --headless render frames offscreen and report their timings as JSON"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--fps", type=float, default=60.0, help="simulated clock")
+    parser.add_argument("--size", type=int, nargs=2, default=(640, 480))
+    parser.add_argument(
+        "--desert", default="chunked", choices=("dynamic", "baked", "chunked")
+    )
+    parser.add_argument(
+        "--compiled", action="store_true", help="draw a flattened CompiledScene"
+    )
+    parser.add_argument("--report", default="frames.json", help="JSON report")
+    parser.add_argument(
+        "--profile",
+        metavar="TRACE",
+        help="profile draws per node, print a table and write a Chrome trace",
+    )
+    args = parser.parse_args()
+
+    if not args.headless:
+        print("\nCONTROLS:")
+        print("- LEFT / RIGHT: change dragon's rotation circle")
+        print("- MOUSE: allows you to move in the scene")
+        print("\npress ENTER to continue...")
+        input()
+
+    # models appear as they are loaded, headless runs wait for all of them
+    viewer = Viewer(*args.size, headless=args.headless)
+    viewer.loader = AsyncLoader(
+        progress=lambda loaded, total, file: print("[%d/%d]" % (loaded, total), file)
+    )
+    build_scene(viewer, args.desert, viewer.loader.load, args.compiled)
+    if args.headless:
+        viewer.loader.finish()
+    profiler = Profiler() if args.profile else contextlib.nullcontext()
+    with profiler:
+        if args.headless:
+            frames = viewer.benchmark(args.frames, 1 / args.fps, args.warmup)
+        else:
+            viewer.run()
+    if args.profile:
+        print(profiler.report())
+        profiler.export_chrome_trace(args.profile)
+    if not args.headless:
+        return
+
+    report = dict(
+        renderer=GL.glGetString(GL.GL_RENDERER).decode(),
+        size=args.size,
+        desert=args.desert,
+        compiled=args.compiled,
+        frame_time=1 / args.fps,
+        mean_cpu_ms=float(np.mean([frame["cpu_ms"] for frame in frames])),
+        mean_gpu_ms=float(np.mean([frame["gpu_ms"] for frame in frames])),
+        baked_animation_kb=baked_nbytes() / 1024,
+        frames=frames,
+    )
+    with open(args.report, "w") as stream:
+        json.dump(report, stream, indent=2)
+    print(
+        "%d frames: %.2f ms CPU, %.2f ms GPU per frame, report in %s"
+        % (len(frames), report["mean_cpu_ms"], report["mean_gpu_ms"], args.report)
+    )
 
-if __name__ == "__main__":
-    print("\nCONTROLS:")
-    print("- LEFT / RIGHT: change dragon's rotation circle")
-    print("- MOUSE: allows you to move in the scene")
-    print("\npress ENTER to continue...")
-    input()
 
+if __name__ == "__main__":
     main()  # main function keeps variables locally scoped